@@ -0,0 +1,354 @@
+import codecs
+import importlib.util
+import os
+import re
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+# Días hacia adelante que cubre cada campaña de recordatorios
+NOTIFICATION_WINDOW_DAYS = 2
+
+REQUIRED_COLUMNS = ['RUT', 'NOMBRE_PACIENTE', 'TELEFONO', 'FECHA_ATENCION',
+                    'MOTIVO_CONSULTA', 'PROFESIONAL', '¿NOTIFICADO?',
+                    '¿CAMBIO DE HORA?', 'NUEVA_FECHA', 'PROFESIONAL_REASIGNADO']
+NOTIFICATION_COLUMNS = ['FECHA_NOTIFICACION', 'HORA_NOTIFICACION', 'METODO_NOTIFICACION']
+AGENDA_COLUMNS = REQUIRED_COLUMNS + NOTIFICATION_COLUMNS
+PHONE_COLUMNS = ['TELEFONO_E164', 'TELEFONO_VALIDO']
+
+CHUNK_SIZE = 50_000
+# Súbelo al cambiar columnas o tipos del frame normalizado (invalida la caché de cargas)
+SCHEMA_VERSION = 6
+
+FLAG_COLUMNS = ['¿NOTIFICADO?', '¿CAMBIO DE HORA?']
+CATEGORY_COLUMNS = ['PROFESIONAL', 'PROFESIONAL_REASIGNADO', 'MOTIVO_CONSULTA', 'METODO_NOTIFICACION']
+STRING_COLUMNS = ['RUT', 'NOMBRE_PACIENTE', 'TELEFONO', 'TELEFONO_E164']
+
+# Lector opcional en Rust; sin él se usa openpyxl en modo read-only.
+# find_spec sólo busca el módulo: se importa cuando de verdad se lee un Excel
+CALAMINE_AVAILABLE = importlib.util.find_spec("python_calamine") is not None
+
+# Con pyarrow los textos se guardan en buffers Arrow en lugar de objetos Python
+STRING_DTYPE = "string[pyarrow]" if importlib.util.find_spec("pyarrow") is not None else "string"
+
+# Se leen como texto: una celda numérica no debe volver como '12345678.0' (ni una clave de RUT)
+KEY_TEXT_COLUMNS = ['RUT', 'TELEFONO']
+INTEGRAL_FLOAT_TEXT = re.compile(r'(\d+)\.0+')
+
+
+def _cell_text(value):
+    """RUT or phone cell as text, without the '.0' a numeric cell (or a CSV written from one) adds"""
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    value = str(value)
+    integral = INTEGRAL_FLOAT_TEXT.fullmatch(value)
+    return integral.group(1) if integral else value
+
+
+# Fechas escritas como texto (CSV): día primero, como en Chile. Se prueban en orden sobre lo
+# que aún no se pudo leer, así el resultado no depende del primer valor de cada bloque
+DATE_COLUMNS = ['FECHA_ATENCION', 'NUEVA_FECHA', 'FECHA_NOTIFICACION']
+TEXT_DATE_FORMATS = ("%d/%m/%Y %H:%M", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y", "%d-%m-%Y %H:%M", "%d-%m-%Y",
+                     "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", "ISO8601")
+
+
+def parse_dates(column):
+    """Datetimes from Excel date cells or day-first text; anything unreadable becomes NaT"""
+    if pd.api.types.is_datetime64_any_dtype(column):
+        return column
+    values = column.astype(object)
+    is_text = values.map(lambda v: isinstance(v, str)).astype(bool)
+    if not is_text.any():
+        return pd.to_datetime(values, errors='coerce')
+    parsed = pd.Series(pd.NaT, index=column.index, dtype='datetime64[ns]')
+    if not is_text.all():
+        parsed[~is_text] = pd.to_datetime(values[~is_text], errors='coerce')
+    text = values[is_text].str.strip()
+    for fmt in TEXT_DATE_FORMATS:
+        if text.empty:
+            break
+        attempt = pd.to_datetime(text, format=fmt, errors='coerce')
+        hit = attempt.notna()
+        parsed[text.index[hit]] = attempt[hit]
+        text = text[~hit]
+    if not text.empty:
+        parsed[text.index] = pd.to_datetime(text, format='mixed', dayfirst=True, errors='coerce')
+    return parsed
+
+
+def normalize_chunk(df):
+    """Keep only the agenda columns, add the missing ones and apply their types"""
+    missing = [c for c in AGENDA_COLUMNS if c not in df.columns]
+    df = df.reindex(columns=AGENDA_COLUMNS)
+    for col in missing:
+        df[col] = pd.Series(None, index=df.index, dtype=object)
+    for col in KEY_TEXT_COLUMNS:
+        df[col] = df[col].map(_cell_text, na_action='ignore').astype(object)
+    for col in DATE_COLUMNS:
+        df[col] = parse_dates(df[col])
+    return df
+
+
+def _iter_sheet(rows, chunk_size, blank=None):
+    """Turn a header row plus value rows into typed chunks of the agenda columns"""
+    header = next(rows, None)
+    if not header:
+        return
+    wanted = [(i, name) for i, name in enumerate(header) if name in AGENDA_COLUMNS]
+    if not wanted:
+        return
+    positions = [i for i, _ in wanted]
+    columns = [name for _, name in wanted]
+    buffer = []
+    for row in rows:
+        values = tuple(None if i >= len(row) or row[i] == blank else row[i] for i in positions)
+        if all(v is None for v in values):
+            continue
+        buffer.append(values)
+        if len(buffer) >= chunk_size:
+            yield normalize_chunk(pd.DataFrame.from_records(buffer, columns=columns))
+            buffer = []
+    if buffer:
+        yield normalize_chunk(pd.DataFrame.from_records(buffer, columns=columns))
+
+
+def _iter_xlsx(file, chunk_size):
+    """Read-only openpyxl iteration over every sheet that carries agenda columns"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield from _iter_sheet(sheet.iter_rows(values_only=True), chunk_size)
+    finally:
+        workbook.close()
+
+
+def _iter_calamine(file, chunk_size):
+    """Same as _iter_xlsx with the Rust calamine reader (xlsx and xls), about 10x faster"""
+    from python_calamine import CalamineWorkbook
+
+    if hasattr(file, 'read'):
+        workbook = CalamineWorkbook.from_filelike(file)
+    else:
+        workbook = CalamineWorkbook.from_path(str(file))
+    for name in workbook.sheet_names:
+        # calamine devuelve '' para las celdas vacías
+        yield from _iter_sheet(iter(workbook.get_sheet_by_name(name).iter_rows()), chunk_size, blank='')
+
+
+def _csv_encoding(f):
+    """'utf-8-sig' if the whole byte stream decodes as UTF-8, else 'cp1252' (Excel "CSV delimitado")"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            decoder.decode(block)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return 'cp1252'
+    return 'utf-8-sig'
+
+
+def _iter_csv(file, chunk_size):
+    if hasattr(file, 'readline'):
+        start = file.tell()
+        encoding = _csv_encoding(file)
+        file.seek(start)
+        first_line = file.readline()
+        file.seek(start)
+    else:
+        with open(file, 'rb') as f:
+            encoding = _csv_encoding(f)
+            f.seek(0)
+            first_line = f.readline()
+    if isinstance(first_line, bytes):
+        first_line = first_line.decode(encoding, errors='replace')
+    # Separador ';' (Excel en español) o ','
+    sep = ';' if first_line.count(';') > first_line.count(',') else ','
+    reader = pd.read_csv(file, sep=sep, chunksize=chunk_size, encoding=encoding, encoding_errors='replace',
+                         usecols=lambda c: c in AGENDA_COLUMNS, dtype=dict.fromkeys(KEY_TEXT_COLUMNS, str))
+    for chunk in reader:
+        yield normalize_chunk(chunk)
+
+
+def iter_agenda_chunks(file, chunk_size=CHUNK_SIZE):
+    """Yield typed agenda chunks from an .xlsx, .xls or .csv upload (or path)"""
+    name = str(getattr(file, 'name', file)).lower()
+    if name.endswith('.csv'):
+        yield from _iter_csv(file, chunk_size)
+    elif CALAMINE_AVAILABLE:
+        yield from _iter_calamine(file, chunk_size)
+    elif name.endswith('.xls'):
+        # openpyxl no lee el formato antiguo
+        yield normalize_chunk(pd.read_excel(file, dtype=dict.fromkeys(KEY_TEXT_COLUMNS, str)))
+    else:
+        yield from _iter_xlsx(file, chunk_size)
+
+
+def read_agenda(file, chunk_size=CHUNK_SIZE):
+    """Whole agenda as one frame with a fresh RangeIndex"""
+    chunks = list(iter_agenda_chunks(file, chunk_size))
+    if not chunks:
+        return normalize_chunk(pd.DataFrame(columns=AGENDA_COLUMNS))
+    return pd.concat(chunks, ignore_index=True)
+
+
+def load_report(path, chunk_size=CHUNK_SIZE):
+    """Rows and load time for reading `path`, plus peak traced memory from a second, traced pass"""
+    started = time.perf_counter()
+    df = read_agenda(path, chunk_size)
+    seconds = time.perf_counter() - started
+    # tracemalloc ralentiza mucho la lectura, por eso se mide en una pasada aparte
+    tracemalloc.start()
+    read_agenda(path, chunk_size)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'archivo': os.path.basename(str(path)),
+        'lector': 'calamine' if CALAMINE_AVAILABLE and not str(path).lower().endswith('.csv') else 'openpyxl/csv',
+        'filas': len(df),
+        'segundos': round(seconds, 3),
+        'memoria_pico_mb': round(peak / 1024 ** 2, 1),
+        'memoria_frame_mb': round(float(df.memory_usage(deep=True).sum()) / 1024 ** 2, 1),
+    }
+
+
+def normalize_phones(phones):
+    """Chilean mobile numbers as E.164 ('+569XXXXXXXX') plus a validity mask
+
+    Accepts 9-digit mobiles, pre-2016 8-digit mobiles (5-9 prefix), numbers already carrying
+    56 (with or without '+' / '00') and any spaces, dashes or dots in between.
+    Each distinct value is normalized once.
+    """
+    codes, uniques = pd.factorize(phones)
+    digits = pd.Series(uniques, dtype=object).astype(str).str.replace(r'\D', '', regex=True)
+    digits = digits.str.replace(r'^00', '', regex=True)
+    lengths = digits.str.len()
+    local = np.select(
+        [lengths.eq(11) & digits.str.startswith('569'),
+         lengths.eq(9) & digits.str.startswith('9'),
+         lengths.eq(8) & digits.str.match(r'[5-9]')],
+        [digits.str[2:], digits, '9' + digits],
+        default='')
+    valid = pd.Series(local, dtype=object).str.fullmatch(r'9\d{8}').fillna(False).to_numpy(dtype=bool)
+    e164 = np.where(valid, '+56' + local.astype(object), None)
+    e164 = np.append(e164, None).astype(object)[codes]  # código -1 (nulo) toma el None final
+    valid = np.append(valid, False)[codes]
+    return (pd.Series(e164, index=phones.index, dtype=object),
+            pd.Series(valid, index=phones.index, dtype=bool))
+
+
+def add_phone_columns(df):
+    """Add TELEFONO_E164 and TELEFONO_VALIDO computed from TELEFONO"""
+    df['TELEFONO_E164'], df['TELEFONO_VALIDO'] = normalize_phones(df['TELEFONO'])
+    return df
+
+
+def as_flag(column):
+    """Nullable boolean column: True/1 -> True, False/0 -> False, anything else -> <NA>"""
+    values = column.astype(object)
+    is_true = (values == True).to_numpy(dtype=bool)
+    is_false = (values == False).to_numpy(dtype=bool)
+    return pd.Series(pd.arrays.BooleanArray(is_true, ~(is_true | is_false)), index=column.index)
+
+
+def is_set(column):
+    """Plain bool mask of the cells that are True (<NA> counts as not set)"""
+    return column.eq(True).fillna(False).to_numpy(dtype=bool)
+
+
+def compact_dtypes(df):
+    """Nullable booleans for flags, categoricals for repeated labels, Arrow-backed strings for ids"""
+    for col in FLAG_COLUMNS:
+        df[col] = as_flag(df[col])
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype("category")
+    for col in STRING_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(STRING_DTYPE)
+    return df
+
+
+def memory_report(df):
+    """Deep memory usage per column in MB, largest first"""
+    usage = df.memory_usage(deep=True, index=False) / 1024 ** 2
+    return pd.DataFrame({'tipo': df.dtypes.astype(str), 'MB': usage.round(2)}).sort_values('MB', ascending=False)
+
+
+class DateIndex:
+    """Row positions of an agenda sorted by appointment day, for range lookups"""
+
+    def __init__(self, dates):
+        days = dates.to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+        valid = ~np.isnat(days)
+        order = np.argsort(days[valid], kind='stable')
+        self.days = days[valid][order]
+        self.positions = np.flatnonzero(valid)[order]
+
+    def _bounds(self, start, end):
+        lo = np.searchsorted(self.days, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(self.days, np.datetime64(end, 'D'), side='right')
+        return lo, hi
+
+    def positions_between(self, start, end):
+        """Row positions with start <= day <= end, in original row order"""
+        lo, hi = self._bounds(start, end)
+        return np.sort(self.positions[lo:hi])
+
+    def count_between(self, start, end):
+        lo, hi = self._bounds(start, end)
+        return int(hi - lo)
+
+
+def window_bounds(today, days=NOTIFICATION_WINDOW_DAYS):
+    return today, today + timedelta(days=days)
+
+
+def select_window(df, date_index, today, target_date):
+    """Rows whose FECHA_ATENCION falls between today and target_date"""
+    return df.iloc[date_index.positions_between(today, target_date)]
+
+
+def _reminder_mask(window):
+    return ~is_set(window['¿NOTIFICADO?'])
+
+
+def _change_mask(window):
+    return (is_set(window['¿CAMBIO DE HORA?']) &
+            window['NUEVA_FECHA'].notnull().to_numpy() &
+            window['PROFESIONAL_REASIGNADO'].notnull().to_numpy())
+
+
+def _valid_phone(window):
+    if 'TELEFONO_VALIDO' not in window.columns:
+        return np.ones(len(window), dtype=bool)
+    return window['TELEFONO_VALIDO'].to_numpy(dtype=bool)
+
+
+def select_reminders(df, date_index, today, target_date):
+    """Appointments in the window that have not been notified yet and have a valid phone"""
+    window = select_window(df, date_index, today, target_date)
+    return window[_reminder_mask(window) & _valid_phone(window)]
+
+
+def select_changes(df, date_index, today, target_date):
+    """Rescheduled appointments in the window with a new date, professional and valid phone"""
+    window = select_window(df, date_index, today, target_date)
+    return window[_change_mask(window) & _valid_phone(window)]
+
+
+def select_invalid_phones(df, date_index, today, target_date):
+    """Window rows that would be notified but are rejected for an invalid phone"""
+    window = select_window(df, date_index, today, target_date)
+    return window[(_reminder_mask(window) | _change_mask(window)) & ~_valid_phone(window)]
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(load_report(path))
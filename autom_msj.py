@@ -1,14 +1,24 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-import io
-import json
-import os
 import time
-import threading
-import requests
-from urllib.parse import quote
-import base64
+from contextlib import closing
+from notification_log import NotificationLog
+from notification_store import ATTEMPT_COLUMNS, NotificationStore
+from dispatcher import build_session
+from rate_limiter import DEFAULT_LIMITS, TokenBucket
+from agenda import window_bounds, select_reminders, select_changes, select_invalid_phones, is_set, memory_report
+from upload_cache import UploadCache, content_digest
+from checkpoint import CampaignCheckpoint
+from export import EXPORT_FORMATS, export_bytes
+from messages import create_reminder_message, create_change_message
+from idempotency import IdempotencyIndex
+from metrics import METRICS, METRICS_FILE
+from notificaciones import (ENV_INFO, SeleniumPool, build_dispatcher, claim_jobs, collect_jobs,
+                            iter_results, load_data, resolve_method, save_log)
+
+# Duración de cada ejecución del script, para el panel de métricas
+_run_started = time.perf_counter()
 
 # Configuración de página
 st.set_page_config(
@@ -17,37 +27,6 @@ st.set_page_config(
     layout="wide"
 )
 
-# Detect environment and available messaging methods
-def detect_environment():
-    """Detect the current environment and available messaging capabilities"""
-    env_info = {
-        'is_cloud': any([
-            'STREAMLIT_SERVER_PORT' in os.environ,
-            'STREAMLIT_BROWSER_GATHER_USAGE_STATS' in os.environ,
-            os.environ.get('DISPLAY') == '',
-            'DISPLAY' not in os.environ
-        ]),
-        'selenium_available': False,
-        'api_available': False
-    }
-    
-    # Check for Selenium
-    if not env_info['is_cloud']:
-        try:
-            from selenium import webdriver
-            from selenium.webdriver.chrome.options import Options
-            env_info['selenium_available'] = True
-        except ImportError:
-            pass
-    
-    # API methods are always available
-    env_info['api_available'] = True
-    
-    return env_info
-
-# Initialize environment
-ENV_INFO = detect_environment()
-
 # CSS
 st.markdown("""
 <style>
@@ -100,272 +79,114 @@ padding: 2rem; border-radius: 10px; margin-bottom: 2rem; color: white; text-alig
 </style>
 """, unsafe_allow_html=True)
 
-# WhatsApp Selenium Class
-class WhatsAppSelenium:
-    def __init__(self):
-        self.driver = None
-        self.is_logged_in = False
-    
-    def setup_driver(self):
-        """Setup Chrome driver for WhatsApp Web"""
-        if ENV_INFO['is_cloud']:
-            return False, "Selenium no disponible en entorno cloud"
-        
-        try:
-            from selenium import webdriver
-            from selenium.webdriver.chrome.options import Options
-            from selenium.webdriver.common.by import By
-            from selenium.webdriver.support.ui import WebDriverWait
-            from selenium.webdriver.support import expected_conditions as EC
-            
-            options = Options()
-            options.add_argument('--no-sandbox')
-            options.add_argument('--disable-dev-shm-usage')
-            options.add_argument('--disable-gpu')
-            options.add_argument('--window-size=1920,1080')
-            
-            # Optional: run in headless mode (uncomment next line)
-            # options.add_argument('--headless')
-            
-            self.driver = webdriver.Chrome(options=options)
-            return True, "Driver configurado exitosamente"
-        except Exception as e:
-            return False, f"Error configurando driver: {str(e)}"
-    
-    def login_whatsapp(self):
-        """Navigate to WhatsApp Web and wait for QR scan"""
-        if not self.driver:
-            return False, "Driver no inicializado"
-        
-        try:
-            from selenium.webdriver.common.by import By
-            from selenium.webdriver.support.ui import WebDriverWait
-            from selenium.webdriver.support import expected_conditions as EC
-            
-            self.driver.get("https://web.whatsapp.com")
-            
-            # Wait for QR code or main interface
-            wait = WebDriverWait(self.driver, 60)
-            
-            # Check if already logged in or need to scan QR
-            try:
-                # Wait for either QR code or chat list
-                wait.until(
-                    lambda driver: driver.find_element(By.CSS_SELECTOR, '[data-testid="qr-code"]') or 
-                                 driver.find_element(By.CSS_SELECTOR, '[data-testid="chat-list"]')
-                )
-                
-                # Check if we're in the main interface
-                if self.driver.find_elements(By.CSS_SELECTOR, '[data-testid="chat-list"]'):
-                    self.is_logged_in = True
-                    return True, "Ya conectado a WhatsApp Web"
-                else:
-                    return False, "Necesita escanear código QR en WhatsApp Web"
-                    
-            except Exception as e:
-                return False, f"Error esperando login: {str(e)}"
-                
-        except Exception as e:
-            return False, f"Error accediendo a WhatsApp Web: {str(e)}"
-    
-    def send_message(self, phone, message):
-        """Send message via WhatsApp Web"""
-        if not self.driver or not self.is_logged_in:
-            return False, "WhatsApp Web no está conectado"
-        
-        try:
-            from selenium.webdriver.common.by import By
-            from selenium.webdriver.common.keys import Keys
-            from selenium.webdriver.support.ui import WebDriverWait
-            from selenium.webdriver.support import expected_conditions as EC
-            
-            # Format phone number
-            if not phone.startswith("+"):
-                phone = "+56" + str(phone)
-            
-            # Navigate to chat
-            url = f"https://web.whatsapp.com/send?phone={phone.replace('+', '')}"
-            self.driver.get(url)
-            
-            wait = WebDriverWait(self.driver, 30)
-            
-            # Wait for message input box
-            message_box = wait.until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, '[data-testid="message-composer"] [contenteditable="true"]'))
-            )
-            
-            # Clear and send message
-            message_box.clear()
-            message_box.send_keys(message)
-            
-            # Find and click send button
-            send_button = wait.until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, '[data-testid="send"]'))
-            )
-            send_button.click()
-            
-            time.sleep(2)  # Wait for message to send
-            return True, "Mensaje enviado via Selenium"
-            
-        except Exception as e:
-            return False, f"Error enviando mensaje: {str(e)}"
-    
-    def close(self):
-        """Close the browser"""
-        if self.driver:
-            self.driver.quit()
-            self.driver = None
-            self.is_logged_in = False
-
-# WhatsApp API alternatives (for cloud environments)
-class WhatsAppAPI:
-    @staticmethod
-    def send_via_api_link(phone, message):
-        """Generate WhatsApp API link for manual sending"""
-        if not phone.startswith("+"):
-            phone = "+56" + str(phone)
-        
-        encoded_message = quote(message)
-        phone_clean = phone.replace("+", "")
-        
-        whatsapp_url = f"https://api.whatsapp.com/send?phone={phone_clean}&text={encoded_message}"
-        
-        return True, f"Link generado: {whatsapp_url}"
-    
-    @staticmethod
-    def send_via_webhook(phone, message, webhook_url=None):
-        """Send via external webhook service (placeholder for custom implementation)"""
-        if not webhook_url:
-            return False, "Webhook URL no configurada"
-        
-        try:
-            payload = {
-                "phone": phone,
-                "message": message,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            response = requests.post(webhook_url, json=payload, timeout=10)
-            if response.status_code == 200:
-                return True, "Mensaje enviado via webhook"
-            else:
-                return False, f"Error webhook: {response.status_code}"
-        except Exception as e:
-            return False, f"Error webhook: {str(e)}"
-
 # Función cargar datos
-@st.cache_data
-def load_data(file):
-    if file is not None:
+@st.cache_resource
+def get_upload_cache():
+    return UploadCache()
+
+def session_cached(name, version, compute):
+    """compute() kept in the session until `version` changes, for values derived on every rerun"""
+    derived = st.session_state.setdefault('derived', {})
+    hit = derived.get(name)
+    if hit is None or hit[0] != version:
+        hit = derived[name] = (version, compute())
+    return hit[1]
+
+def upload_digest(file):
+    """Content hash of an upload, computed once per uploaded file"""
+    digests = st.session_state.setdefault('upload_digests', {})
+    if file.file_id not in digests:
+        digests[file.file_id] = content_digest(file)
+    return digests[file.file_id]
+
+@st.cache_resource(max_entries=4)
+def load_upload(digest, _file):
+    """Return (df, date_index) for an upload keyed by its content hash
+
+    The file object itself is not hashed (leading underscore); parsed frames
+    are also kept on disk so other processes reopen the same agenda from cache.
+    The frame is shared, not copied per rerun: treat it as read-only (a
+    campaign works on its own copy).
+    """
+    if _file is not None:
         try:
-            df = pd.read_excel(file, dtype={'TELEFONO': str})
-            required_columns = ['RUT','NOMBRE_PACIENTE','TELEFONO','FECHA_ATENCION',
-                                'MOTIVO_CONSULTA','PROFESIONAL','¿NOTIFICADO?',
-                                '¿CAMBIO DE HORA?','NUEVA_FECHA','PROFESIONAL_REASIGNADO']
-            for col in required_columns:
-                if col not in df.columns:
-                    df[col] = None
-            for col in ['FECHA_NOTIFICACION','HORA_NOTIFICACION','METODO_NOTIFICACION']:
-                if col not in df.columns:
-                    df[col] = None
-            df['FECHA_ATENCION'] = pd.to_datetime(df['FECHA_ATENCION'], errors='coerce')
-            df['NUEVA_FECHA'] = pd.to_datetime(df['NUEVA_FECHA'], errors='coerce')
-            return df
+            return load_data(_file, get_upload_cache(), digest)
         except Exception as e:
             st.error(f"Error al cargar el archivo: {str(e)}")
-            return pd.DataFrame()
-    return pd.DataFrame()
+            return pd.DataFrame(), None
+    return pd.DataFrame(), None
 
 # Guardar logs
-def save_log(log_entry):
-    log_file = "notification_log.json"
-    logs = []
-    if os.path.exists(log_file):
-        try:
-            with open(log_file,"r", encoding='utf-8') as f:
-                logs = json.load(f)
-        except:
-            logs = []
-    logs.append(log_entry)
+@st.cache_resource
+def get_notification_log():
+    """Shared append-only log; migrates the legacy JSON file on first start"""
+    log = NotificationLog()
+    log.migrate_legacy()
+    return log
+
+@st.cache_resource
+def get_notification_store():
+    """Shared SQLite store; seeded from the JSON Lines log the first time, then pruned with it"""
+    log = get_notification_log()
+    store = NotificationStore()
+    if store.attempt_count() == 0:
+        store.import_attempts(log.read())
+    log.on_expire = store.prune_attempts
+    return store
+
+def record_log(log_entry):
     try:
-        with open(log_file,"w", encoding='utf-8') as f:
-            json.dump(logs, f, indent=2, default=str, ensure_ascii=False)
+        save_log(log_entry, get_notification_log(), get_notification_store())
     except Exception as e:
         st.error(f"Error al guardar log: {str(e)}")
 
-# Main sending function with multiple methods
-def send_whatsapp_message(phone, message, method="auto"):
-    """Send WhatsApp message using available method"""
-    
-    if method == "selenium" and ENV_INFO['selenium_available']:
-        if 'whatsapp_selenium' not in st.session_state:
-            st.session_state.whatsapp_selenium = WhatsAppSelenium()
-        
-        selenium_client = st.session_state.whatsapp_selenium
-        if not selenium_client.driver:
-            success, msg = selenium_client.setup_driver()
-            if not success:
-                return False, msg
-            success, msg = selenium_client.login_whatsapp()
-            if not success:
-                return False, msg
-        
-        return selenium_client.send_message(phone, message)
-    
-    elif method == "api_link":
-        return WhatsAppAPI.send_via_api_link(phone, message)
-    
-    elif method == "webhook":
-        webhook_url = st.session_state.get('webhook_url', None)
-        return WhatsAppAPI.send_via_webhook(phone, message, webhook_url)
-    
-    else:
-        # Auto mode - use best available method
-        if ENV_INFO['selenium_available'] and not ENV_INFO['is_cloud']:
-            return send_whatsapp_message(phone, message, "selenium")
-        else:
-            return send_whatsapp_message(phone, message, "api_link")
-
-# Mensajes
-def create_reminder_message(row):
-    fecha_cita = row['FECHA_ATENCION'].strftime("%d/%m/%Y") if pd.notnull(row['FECHA_ATENCION']) else "sin fecha"
-    return f"""🏥 CESFAM Cholchol - Recordatorio de Cita 🏥
-
-Hola {row['NOMBRE_PACIENTE']},
-
-Le recordamos que tiene programada una cita médica:
-
-📅 Fecha: {fecha_cita}
-👨‍⚕️ Profesional: {row['PROFESIONAL']}
-📋 Motivo: {row['MOTIVO_CONSULTA']}
-
-📍 Lugar: Centro de Salud Familiar CESFAM Cholchol
-Calle Anibal Pinto 552, Cholchol
-
-📋 Recomendaciones:
-- Llegar 15 minutos antes de su hora de cita
-- Traer su cédula de identidad y carnet de salud
-- Si no puede asistir, notificar con anticipación
-
-Para confirmar, reagendar o consultar:
-📧 Email: cholcholsome@gmail.com
-
-*Este es un mensaje automático, por favor no responder directamente.*"""
-
-def create_change_message(row):
-    nueva_fecha = row['NUEVA_FECHA'].strftime("%d/%m/%Y") if pd.notnull(row['NUEVA_FECHA']) else "sin fecha"
-    profesional = row['PROFESIONAL_REASIGNADO'] if pd.notnull(row['PROFESIONAL_REASIGNADO']) else "No asignado"
-    return f"""🏥 CESFAM Cholchol - Cambio de Cita 🏥
-
-Hola {row['NOMBRE_PACIENTE']},
-
-Su cita ha sido reprogramada:
-
-📅 Nueva Fecha: {nueva_fecha}
-👨‍⚕️ Profesional: {profesional}
-📋 Motivo: {row['MOTIVO_CONSULTA']}
-
-*Mensaje automático*"""
+@st.cache_resource
+def get_checkpoint(digest):
+    """Progress journal of the campaign for one upload, shared across reruns and sessions"""
+    return CampaignCheckpoint(digest)
+
+@st.cache_resource
+def get_idempotency_index():
+    """Sent-notification index shared by every session, across uploads"""
+    return IdempotencyIndex()
+
+@st.cache_resource
+def get_selenium_clients():
+    """WhatsApp Web browsers by profile, shared by every session: a Chrome profile opens only once"""
+    return {}
+
+def get_selenium_pool():
+    """Session pool for the configured sender numbers, rebuilt when they change
+
+    The browsers behind it are the process-wide ones of get_selenium_clients, so
+    two tabs with the same sender share one driver instead of fighting over its profile.
+    """
+    senders = st.session_state.get('selenium_senders', ['principal'])
+    pool = st.session_state.get('whatsapp_pool')
+    if pool is None or pool.senders != senders:
+        pool = SeleniumPool(senders, clients=get_selenium_clients())
+        st.session_state.whatsapp_pool = pool
+    pool.fast_path = st.session_state.get('selenium_fast_path', True)
+    return pool
+
+@st.cache_resource
+def get_http_session(pool_size):
+    """Keep-alive connection pool shared by every webhook send in this process"""
+    return build_session(pool_size)
+
+@st.cache_resource
+def get_rate_limiter(method):
+    """Token bucket per send method, shared by every run in this process"""
+    rate, burst = DEFAULT_LIMITS[method]
+    return TokenBucket(rate, burst)
+
+def get_dispatcher(method, concurrency=1, batch_size=0, max_linger=0.5):
+    """Dispatcher for `method` wired to this session's pool, webhook and limiter"""
+    pool = get_selenium_pool() if resolve_method(method) == "selenium" else None
+    return build_dispatcher(method, limiter=get_rate_limiter(resolve_method(method)), pool=pool,
+                            webhook_url=st.session_state.get('webhook_url', None),
+                            session=get_http_session(concurrency), concurrency=concurrency,
+                            batch_size=batch_size, max_linger=max_linger)
 
 # Cabecera
 st.markdown("""
@@ -420,89 +241,186 @@ with st.sidebar:
         st.info("🔗 Método: API Links (único disponible)")
     
     # Webhook configuration (optional)
+    concurrency = 1
+    batch_size = 0
+    max_linger = 0.5
     if st.checkbox("Configurar Webhook personalizado"):
         webhook_url = st.text_input("URL del Webhook:", placeholder="https://tu-webhook.com/whatsapp")
         if webhook_url:
             st.session_state.webhook_url = webhook_url
             send_method = "webhook"
+            concurrency = st.slider("Envíos simultáneos:", min_value=1, max_value=32, value=8,
+                                    help="Solicitudes en paralelo sobre conexiones reutilizadas")
+            if st.checkbox("Modo lote", help="Agrupa varios mensajes en un solo POST"):
+                batch_size = st.number_input("Mensajes por lote:", min_value=2, max_value=1000, value=50)
+                max_linger = st.slider("Espera máxima por lote (ms):", 0, 2000, 500) / 1000
+    
+    # Límite de envío por método
+    limit_method = resolve_method(send_method)
+    default_rate, default_burst = DEFAULT_LIMITS[limit_method]
+    with st.expander("⏱️ Límite de envío", expanded=False):
+        rate_limit = st.number_input("Mensajes por segundo:", min_value=0.05, max_value=500.0,
+                                     value=default_rate, key=f"rate_{limit_method}")
+        burst_limit = st.number_input("Ráfaga máxima:", min_value=1, max_value=1000,
+                                      value=default_burst, key=f"burst_{limit_method}")
+    get_rate_limiter(limit_method).configure(rate_limit, burst_limit)
     
     mode = st.radio("Modo de ejecución:", ("Manual", "Automático"))
     
     # Selenium controls
     if ENV_INFO['selenium_available'] and send_method in ["auto", "selenium"]:
         st.header("🤖 Control de Selenium")
+        senders_text = st.text_input("Números remitentes (separados por coma):", value="principal",
+                                     help="Cada remitente usa su propio perfil de Chrome y navegador")
+        st.session_state.selenium_senders = [s.strip() for s in senders_text.split(",") if s.strip()] or ['principal']
+        st.session_state.selenium_fast_path = st.checkbox(
+            "Envío rápido", value=True,
+            help="Cambia de chat sin recargar, pega el mensaje completo y espera el tick de enviado en lugar de 2 s fijos")
+        
         if st.button("🔄 Reiniciar WhatsApp Web"):
-            if 'whatsapp_selenium' in st.session_state:
-                st.session_state.whatsapp_selenium.close()
-                del st.session_state.whatsapp_selenium
+            if 'whatsapp_pool' in st.session_state:
+                st.session_state.whatsapp_pool.close_all()
+                del st.session_state.whatsapp_pool
             st.success("Selenium reiniciado")
         
         if st.button("❌ Cerrar navegador"):
-            if 'whatsapp_selenium' in st.session_state:
-                st.session_state.whatsapp_selenium.close()
-                del st.session_state.whatsapp_selenium
+            if 'whatsapp_pool' in st.session_state:
+                st.session_state.whatsapp_pool.close_all()
+                del st.session_state.whatsapp_pool
                 st.success("Navegador cerrado")
+        
+        if 'whatsapp_pool' in st.session_state:
+            pool = st.session_state.whatsapp_pool
+            st.dataframe(pd.DataFrame(pool.status()), hide_index=True)
+            for client in pool.clients.values():
+                for path, stats in client.latency_stats().items():
+                    st.caption(f"{path}: {stats['total']:.2f} s/mensaje ({stats['mensajes']} envíos)")
     
     st.header("📊 Registro")
-    show_logs = st.button("📋 Ver Registros")
+    if st.button("📋 Ver Registros"):
+        st.session_state.show_logs = True
     
     if st.button("🗑️ Limpiar Logs"):
-        if os.path.exists("notification_log.json"):
-            os.remove("notification_log.json")
-            st.success("Logs eliminados")
+        get_notification_log().clear()
+        get_notification_store().clear_attempts()
+        st.success("Logs eliminados")
+    
+    # Compartida por todas las sesiones, como el log mismo
+    notification_log = get_notification_log()
+    retention_days = st.number_input("Conservar registros (días, 0 = siempre):", min_value=0, max_value=3650,
+                                     value=notification_log.retention_days or 0,
+                                     help="El log y los intentos guardados más antiguos que esto se borran")
+    if (retention_days or None) != notification_log.retention_days:
+        get_notification_store()  # engancha la poda de intentos antes de rotar
+        notification_log.retention_days = retention_days or None
+        notification_log.rotate()
+    
+    with st.expander("📈 Métricas de rendimiento", expanded=False):
+        METRICS.enabled = st.checkbox("Medir tiempos por etapa", value=METRICS.enabled,
+                                      help="Carga, filtro, mensajes, envío por método, log y dibujo de la página")
+        if METRICS.enabled:
+            # Valores hasta la ejecución anterior: la barra lateral se dibuja antes que el resto
+            snapshot = METRICS.snapshot()
+            if snapshot:
+                st.dataframe(pd.DataFrame(snapshot), hide_index=True)
+                for (name, labels), value in METRICS.counters().items():
+                    st.caption(f"{name} ({labels}): {value}")
+                st.download_button("⬇️ metrics.prom", data=METRICS.render(), file_name=METRICS_FILE,
+                                   mime="text/plain")
+            else:
+                st.caption("Sin mediciones todavía")
+            if st.button("Reiniciar métricas"):
+                METRICS.reset()
 
 # Carga Excel
 st.header("📂 Carga de Datos")
-uploaded_file = st.file_uploader("Subir archivo Excel con citas médicas", type=["xlsx","xls"])
+uploaded_file = st.file_uploader("Subir archivo Excel o CSV con citas médicas", type=["xlsx","xls","csv"])
 
 if uploaded_file:
-    df = load_data(uploaded_file)
+    df, date_index = load_upload(upload_digest(uploaded_file), uploaded_file)
     
     if not df.empty:
         st.success(f"✅ Archivo cargado: {len(df)} registros encontrados")
+        if not get_upload_cache().enabled:
+            st.caption("ℹ️ Caché de cargas deshabilitada (falta pyarrow): cada archivo nuevo se vuelve a leer completo")
+        
+        # Sincronizar la agenda con el store una vez por archivo subido
+        store = get_notification_store()
+        if st.session_state.get('synced_upload') != uploaded_file.file_id:
+            store.sync_appointments(df, upload_digest(uploaded_file), uploaded_file.name)
+            st.session_state.synced_upload = uploaded_file.file_id
+        # Sólo cambian al sincronizar otro archivo o tras una campaña (que sube df_version)
+        stats = session_cached('stats', (uploaded_file.file_id, st.session_state.get('df_version', 0)),
+                               lambda: store.appointment_stats(upload_digest(uploaded_file)))
         
         # Mostrar estadísticas básicas
-        col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4, col5 = st.columns(5)
         with col1:
             st.metric("Total Citas", len(df))
         with col2:
-            notificados = len(df[df['¿NOTIFICADO?'] == True])
-            st.metric("Ya Notificados", notificados)
+            st.metric("Ya Notificados", stats['notificados'])
         with col3:
-            pendientes = len(df[df['¿NOTIFICADO?'] != True])
-            st.metric("Pendientes", pendientes)
+            st.metric("Pendientes", stats['pendientes'])
         with col4:
-            cambios = len(df[df['¿CAMBIO DE HORA?'] == True])
-            st.metric("Con Cambios", cambios)
+            st.metric("Con Cambios", stats['cambios'])
+        with col5:
+            st.metric("En Ventana (2 días)", date_index.count_between(*window_bounds(datetime.now().date())))
+        
+        with st.sidebar:
+            report = session_cached('memory', upload_digest(uploaded_file), lambda: memory_report(df))
+            with st.expander(f"🧠 Memoria de la agenda: {report['MB'].sum():.2f} MB", expanded=False):
+                st.dataframe(report, use_container_width=True)
+        
+        invalid_phones = int((~df['TELEFONO_VALIDO']).sum())
+        if invalid_phones:
+            with st.expander(f"⚠️ {invalid_phones} registros con teléfono inválido (no se les enviará mensaje)"):
+                st.dataframe(df.loc[~df['TELEFONO_VALIDO'], ['RUT', 'NOMBRE_PACIENTE', 'TELEFONO', 'FECHA_ATENCION']],
+                             hide_index=True)
 
 # Función principal
-def process_notifications(df, method="auto"):
+UI_REFRESH_INTERVAL = 0.25  # segundos entre refrescos de la UI durante una campaña
+LIVE_RESULT_ROWS = 15
+RESULT_LABELS = {"Enviado": "✅ Enviado", "Sin confirmar": "⚠️ Sin confirmar", "Error": "❌ Error"}
+RESULTS_PAGE_SIZES = [25, 50, 100, 250]
+PREVIEW_PAGE_SIZES = [100, 500, 1000, 5000]
+
+def publish_df(df):
+    """Expose `df` as the session's updated agenda; the version invalidates cached exports"""
+    st.session_state.df = df
+    st.session_state.df_version = st.session_state.get('df_version', 0) + 1
+
+def process_notifications(df, date_index, method="auto", concurrency=1, batch_size=0, max_linger=0.5, checkpoint=None):
     if df.empty:
         st.error("No hay datos para procesar")
         return
     
+    # Reanudar: recuperar los envíos ya registrados por una ejecución interrumpida
+    if checkpoint is not None:
+        restored = checkpoint.apply(df)
+        if restored:
+            st.info(f"♻️ Reanudando campaña: {restored} envíos ya registrados se omiten")
+    # El DataFrame de la sesión refleja el avance aunque la ejecución se corte
+    publish_df(df)
+    
     success_count = 0
     error_count = 0
-    links_generated = []
-    today = datetime.now().date()
-    target_date = today + timedelta(days=2)
+    unconfirmed_count = 0
     
     progress_bar = st.progress(0)
     status_text = st.empty()
-    
-    # 1️⃣ Recordatorios de citas nuevas (no notificadas)
-    to_notify = df[(df['¿NOTIFICADO?'] != True) & 
-                   (df['FECHA_ATENCION'].dt.date >= today) &
-                   (df['FECHA_ATENCION'].dt.date <= target_date)]
-    
-    # 2️⃣ Mensajes de reprogramación
-    changed_appointments = df[(df['¿CAMBIO DE HORA?'] == True) &
-                              df['NUEVA_FECHA'].notnull() &
-                              df['PROFESIONAL_REASIGNADO'].notnull() &
-                              (df['FECHA_ATENCION'].dt.date >= today) &
-                              (df['FECHA_ATENCION'].dt.date <= target_date)]
-    
-    total_to_process = len(to_notify) + len(changed_appointments)
+    live_table = st.empty()
+    
+    # Recordatorios y cambios de cita de la ventana, con sus mensajes ya renderizados
+    jobs = collect_jobs(df, date_index, checkpoint=checkpoint)
+    rejected = select_invalid_phones(df, date_index, *window_bounds(datetime.now().date()))
+    if not rejected.empty:
+        st.warning(f"📵 {len(rejected)} citas de la ventana se rechazan por teléfono inválido")
+    # Omitir lo que ya se envió desde otra carga u otra sesión
+    idempotency = get_idempotency_index()
+    jobs, duplicates = claim_jobs(jobs, idempotency)
+    if duplicates:
+        st.info(f"🔁 {duplicates} notificaciones repetidas o ya enviadas anteriormente se omiten")
+    total_to_process = len(jobs)
     
     if total_to_process == 0:
         st.info("📋 No hay citas que requieran notificación en este momento")
@@ -511,111 +429,176 @@ def process_notifications(df, method="auto"):
     st.info(f"📤 Procesando {total_to_process} notificaciones usando método: **{method}**")
     processed = 0
     
-    # Procesar recordatorios
-    for idx, row in to_notify.iterrows():
-        status_text.text(f"Enviando recordatorio a {row['NOMBRE_PACIENTE']}...")
-        message = create_reminder_message(row)
-        phone = row['TELEFONO']
-        
-        # Mostrar preview del mensaje
-        with st.expander(f"📱 Mensaje para {row['NOMBRE_PACIENTE']}", expanded=False):
-            st.markdown(f'<div class="message-preview">{message}</div>', unsafe_allow_html=True)
-        
-        success, result = send_whatsapp_message(phone, message, method)
-        
-        if success:
-            df.at[idx, '¿NOTIFICADO?'] = True
-            df.at[idx, 'FECHA_NOTIFICACION'] = datetime.now().date()
-            df.at[idx, 'HORA_NOTIFICACION'] = datetime.now().strftime("%H:%M:%S")
-            df.at[idx, 'METODO_NOTIFICACION'] = method
-            success_count += 1
-            st.markdown(f'<div class="success-message">✅ {row["NOMBRE_PACIENTE"]}: {result}</div>', unsafe_allow_html=True)
-            
-            if "Link generado:" in result:
-                links_generated.append({
-                    'patient': row['NOMBRE_PACIENTE'],
-                    'phone': phone,
-                    'link': result.replace("Link generado: ", "")
-                })
-        else:
-            error_count += 1
-            st.markdown(f'<div class="error-message">❌ Error enviando a {row["NOMBRE_PACIENTE"]}: {result}</div>', unsafe_allow_html=True)
-        
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "patient": row['NOMBRE_PACIENTE'],
-            "phone": phone,
-            "type": "Recordatorio",
-            "method": method,
-            "message": message,
-            "status": "Enviado" if success else "Error",
-            "result": result
-        }
-        save_log(log_entry)
-        
-        processed += 1
-        progress_bar.progress(processed / total_to_process)
-        time.sleep(0.5)
-    
-    # Procesar cambios de cita
-    for idx, row in changed_appointments.iterrows():
-        status_text.text(f"Enviando cambio de cita a {row['NOMBRE_PACIENTE']}...")
-        message = create_change_message(row)
-        phone = row['TELEFONO']
-        
-        with st.expander(f"📱 Cambio de cita para {row['NOMBRE_PACIENTE']}", expanded=False):
-            st.markdown(f'<div class="message-preview">{message}</div>', unsafe_allow_html=True)
-        
-        success, result = send_whatsapp_message(phone, message, method)
-        
-        if success:
-            df.at[idx, 'FECHA_NOTIFICACION'] = datetime.now().date()
-            df.at[idx, 'HORA_NOTIFICACION'] = datetime.now().strftime("%H:%M:%S")
-            df.at[idx, 'METODO_NOTIFICACION'] = method
-            df.at[idx, '¿CAMBIO DE HORA?'] = False
-            success_count += 1
-            st.markdown(f'<div class="success-message">✅ {row["NOMBRE_PACIENTE"]}: {result}</div>', unsafe_allow_html=True)
-            
-            if "Link generado:" in result:
-                links_generated.append({
-                    'patient': row['NOMBRE_PACIENTE'],
-                    'phone': phone,
-                    'link': result.replace("Link generado: ", "")
-                })
-        else:
-            error_count += 1
-            st.markdown(f'<div class="error-message">❌ Error enviando cambio a {row["NOMBRE_PACIENTE"]}: {result}</div>', unsafe_allow_html=True)
-        
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "patient": row['NOMBRE_PACIENTE'],
-            "phone": phone,
-            "type": "Cambio de Cita",
-            "method": method,
-            "message": message,
-            "status": "Enviado" if success else "Error",
-            "result": result
-        }
-        save_log(log_entry)
+    dispatcher = get_dispatcher(method, concurrency, batch_size, max_linger)
+    
+    # Los resultados vuelven al hilo del script, que los acumula en un búfer y
+    # refresca la UI a un ritmo fijo, sin importar el tamaño de la campaña
+    results = []
+    st.session_state.campaign_results = None
+    last_refresh = 0.0
+    # closing(): si un rerun corta el ciclo, lo que estaba en vuelo también queda en el log y la base
+    with closing(iter_results(df, jobs, dispatcher, method, checkpoint, idempotency, log_fn=record_log)) as campaign:
+        for idx, tipo, row, message, success, result, log_entry in campaign:
+            if success:
+                success_count += 1
+            elif log_entry['status'] == "Sin confirmar":
+                unconfirmed_count += 1
+            else:
+                error_count += 1
+            results.append({
+                'fila': idx,
+                'tipo': tipo,
+                'paciente': row['NOMBRE_PACIENTE'],
+                'telefono': row['TELEFONO_E164'],
+                'estado': RESULT_LABELS[log_entry['status']],
+                'resultado': result,
+                'enlace': result.replace("Link generado: ", "") if "Link generado:" in result else None,
+            })
+            record_log(log_entry)
         
-        processed += 1
-        progress_bar.progress(processed / total_to_process)
-        time.sleep(0.5)
-    
+            processed += 1
+            now = time.monotonic()
+            if now - last_refresh >= UI_REFRESH_INTERVAL:
+                last_refresh = now
+                progress_bar.progress(processed / total_to_process)
+                status_text.text(f"{processed}/{total_to_process} procesadas · ✅ {success_count} · ❌ {error_count} · "
+                                 f"última: {row['NOMBRE_PACIENTE']}")
+                live_table.dataframe(pd.DataFrame(results[-LIVE_RESULT_ROWS:]), hide_index=True,
+                                     use_container_width=True)
+    
+    get_notification_log().flush()
+    if checkpoint is not None:
+        checkpoint.flush()
     progress_bar.progress(1.0)
     status_text.text("✅ Proceso completado")
+    live_table.empty()
+    
+    summary = f"📊 **Resultados del proceso:**\n- ✅ Exitosos: {success_count}\n- ❌ Errores: {error_count}"
+    if unconfirmed_count:
+        summary += f"\n- ⚠️ Sin confirmar: {unconfirmed_count} (revisar en WhatsApp antes de reenviar)"
+    st.success(summary)
+    
+    st.session_state.campaign_results = pd.DataFrame(results)
+    st.session_state.pop('results_page', None)
+    publish_df(df)
+
+def message_preview(df, idx, tipo):
+    """Render the message of one result row only when it is asked for"""
+    row = df.loc[idx]
+    return create_reminder_message(row) if tipo == "Recordatorio" else create_change_message(row)
+
+def render_results():
+    """Paginated table of the last campaign's results, with on-demand message previews"""
+    results = st.session_state.get('campaign_results')
+    if results is None or results.empty:
+        return
+    st.header("📬 Resultados de la Campaña")
     
-    st.success(f"📊 **Resultados del proceso:**\n- ✅ Exitosos: {success_count}\n- ❌ Errores: {error_count}")
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        estado = st.selectbox("Mostrar:", ["Todos", *RESULT_LABELS.values()], key="results_filter")
+    view = results if estado == "Todos" else results[results['estado'] == estado]
+    with col2:
+        page_size = st.selectbox("Filas por página:", RESULTS_PAGE_SIZES, key="results_page_size")
+    pages = max(1, -(-len(view) // page_size))
+    with col3:
+        page = st.number_input(f"Página (de {pages}):", min_value=1, max_value=pages, value=1, key="results_page")
+    page_view = view.iloc[(page - 1) * page_size:page * page_size]
+    
+    st.dataframe(page_view, hide_index=True, use_container_width=True, column_config={
+        'enlace': st.column_config.LinkColumn("Enlace", display_text="Abrir WhatsApp"),
+    })
+    
+    if not page_view.empty and 'df' in st.session_state:
+        labels = {i: f"{r.paciente} · {r.tipo} · {r.estado}" for i, r in enumerate(page_view.itertuples())}
+        choice = st.selectbox("👁️ Ver mensaje de:", [None] + list(labels), key="results_preview",
+                              format_func=lambda i: "—" if i is None else labels[i])
+        if choice is not None:
+            selected = page_view.iloc[choice]
+            message = message_preview(st.session_state.df, selected['fila'], selected['tipo'])
+            st.markdown(f'<div class="message-preview">{message}</div>', unsafe_allow_html=True)
+
+LOG_PAGE_SIZES = [50, 100, 500]
+
+def _older_logs(cursor):
+    st.session_state.log_cursors.append(cursor)
+
+def _newer_logs():
+    if len(st.session_state.log_cursors) > 1:
+        st.session_state.log_cursors.pop()
+
+def render_logs():
+    """Filtered, keyset-paginated view of the attempt index; message bodies only on request"""
+    st.header("📋 Registro de Notificaciones")
+    store = get_notification_store()
     
-    # Show generated links if any
-    if links_generated:
-        st.header("🔗 Enlaces de WhatsApp Generados")
-        st.info("Haga clic en los enlaces para abrir WhatsApp con el mensaje pre-cargado:")
-        
-        for link_info in links_generated:
-            st.markdown(f"**{link_info['patient']}** ({link_info['phone']}): [Abrir WhatsApp]({link_info['link']})")
+    col1, col2, col3, col4, col5 = st.columns([2, 1, 1, 1, 2])
+    with col1:
+        dates = st.date_input("Rango de fechas:", value=(), key="log_dates")
+    with col2:
+        status = st.selectbox("Estado:", [None, *RESULT_LABELS], key="log_status",
+                              format_func=lambda v: v or "Todos")
+    with col3:
+        method = st.selectbox("Método:", [None, "selenium", "api_link", "webhook", "auto"], key="log_method",
+                              format_func=lambda v: v or "Todos")
+    with col4:
+        tipo = st.selectbox("Tipo:", [None, "Recordatorio", "Cambio de Cita"], key="log_type",
+                            format_func=lambda v: v or "Todos")
+    with col5:
+        patient = st.text_input("Paciente (RUT o nombre):", key="log_patient").strip() or None
+    
+    since = until = None
+    if len(dates) >= 1:
+        since = datetime.combine(dates[0], datetime.min.time())
+    if len(dates) == 2:
+        until = datetime.combine(dates[1] + timedelta(days=1), datetime.min.time())
+    filters = dict(status=status, since=since, until=until, method=method, tipo=tipo, patient=patient)
+    
+    # Un cambio de filtros vuelve a la primera página
+    if st.session_state.get('log_filters') != filters:
+        st.session_state.log_filters = filters
+        st.session_state.log_cursors = [None]
+    
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        page_size = st.selectbox("Filas por página:", LOG_PAGE_SIZES, key="log_page_size")
+    with col2:
+        with_messages = st.checkbox("Incluir texto de los mensajes", key="log_messages")
     
-    st.session_state.df = df
+    try:
+        columns = ['id'] + ATTEMPT_COLUMNS if with_messages else None
+        page = store.query_attempts(**filters, columns=columns, limit=page_size,
+                                    before_id=st.session_state.log_cursors[-1])
+    except Exception as e:
+        st.error(f"Error al cargar logs: {str(e)}")
+        return
+    
+    if page.empty and len(st.session_state.log_cursors) == 1:
+        st.info("No hay registros de notificaciones para estos filtros")
+    else:
+        st.caption(f"Página {len(st.session_state.log_cursors)}")
+        st.dataframe(page, hide_index=True, use_container_width=True)
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.button("⬅️ Más recientes", on_click=_newer_logs, disabled=len(st.session_state.log_cursors) == 1)
+    with col2:
+        st.button("Más antiguos ➡️", on_click=_older_logs, args=(int(page['id'].min()) if not page.empty else None,),
+                  disabled=len(page) < page_size)
+    with col3:
+        if st.button("🔢 Contar resultados"):
+            st.write(f"{store.count_attempts(**filters)} registros")
+    with col4:
+        if st.button("✖️ Cerrar registros"):
+            st.session_state.show_logs = False
+            st.rerun()
+    
+    if not page.empty and not with_messages:
+        attempt_id = st.selectbox("👁️ Ver mensaje del registro:", [None] + page['id'].tolist(), key="log_preview",
+                                  format_func=lambda i: "—" if i is None else f"#{i}")
+        if attempt_id is not None:
+            st.markdown(f'<div class="message-preview">{store.attempt_message(attempt_id)}</div>',
+                        unsafe_allow_html=True)
 
 # Ejecutar notificaciones AUTOMÁTICAMENTE
 if uploaded_file and not df.empty:
@@ -639,7 +622,8 @@ if uploaded_file and not df.empty:
             st.info("⚡ El sistema procesará automáticamente cada notificación, usuario por usuario...")
             
             # Procesar automáticamente
-            process_notifications(df, send_method)
+            process_notifications(df.copy(), date_index, send_method, concurrency, batch_size, max_linger,
+                                  get_checkpoint(upload_digest(uploaded_file)))
             
             # Resetear el estado
             if 'auto_processing' in st.session_state:
@@ -651,105 +635,112 @@ if uploaded_file and not df.empty:
                 if 'notifications_processed' in st.session_state:
                     del st.session_state.notifications_processed
                 st.rerun()
+            if st.button("♻️ Reiniciar progreso de la campaña",
+                         help="Olvida los envíos registrados para este archivo; la próxima ejecución parte de cero"):
+                get_checkpoint(upload_digest(uploaded_file)).clear()
+                st.success("Progreso de la campaña reiniciado")
     
     # Manual mode
     elif mode == "Manual":
         if st.button("📋 Vista Previa de Notificaciones", type="secondary"):
             # Mostrar qué se va a procesar
-            today = datetime.now().date()
-            target_date = today + timedelta(days=2)
+            today, target_date = window_bounds(datetime.now().date())
             
-            to_notify = df[(df['¿NOTIFICADO?'] != True) & 
-                           (df['FECHA_ATENCION'].dt.date >= today) &
-                           (df['FECHA_ATENCION'].dt.date <= target_date)]
-            
-            changed_appointments = df[(df['¿CAMBIO DE HORA?'] == True) &
-                                      df['NUEVA_FECHA'].notnull() &
-                                      df['PROFESIONAL_REASIGNADO'].notnull() &
-                                      (df['FECHA_ATENCION'].dt.date >= today) &
-                                      (df['FECHA_ATENCION'].dt.date <= target_date)]
+            to_notify = select_reminders(df, date_index, today, target_date)
+            changed_appointments = select_changes(df, date_index, today, target_date)
             
+            rejected = select_invalid_phones(df, date_index, today, target_date)
             total = len(to_notify) + len(changed_appointments)
             
             if total > 0:
                 st.info(f"📊 Se procesarán **{total}** notificaciones:")
                 st.write("**Recordatorios pendientes:**", len(to_notify))
                 st.write("**Cambios de cita:**", len(changed_appointments))
+                if not rejected.empty:
+                    st.write("**Rechazadas por teléfono inválido:**", len(rejected))
                 
                 # Mostrar lista de pacientes
                 if not to_notify.empty:
                     st.write("👥 **Pacientes para recordatorio:**")
                     for _, row in to_notify.iterrows():
-                        st.write(f"- {row['NOMBRE_PACIENTE']} ({row['TELEFONO']}) - {row['FECHA_ATENCION'].strftime('%d/%m/%Y')}")
+                        st.write(f"- {row['NOMBRE_PACIENTE']} ({row['TELEFONO_E164']}) - {row['FECHA_ATENCION'].strftime('%d/%m/%Y')}")
                 
                 if not changed_appointments.empty:
                     st.write("🔄 **Pacientes con cambios:**")
                     for _, row in changed_appointments.iterrows():
-                        st.write(f"- {row['NOMBRE_PACIENTE']} ({row['TELEFONO']}) - Nueva fecha: {row['NUEVA_FECHA'].strftime('%d/%m/%Y')}")
+                        st.write(f"- {row['NOMBRE_PACIENTE']} ({row['TELEFONO_E164']}) - Nueva fecha: {row['NUEVA_FECHA'].strftime('%d/%m/%Y')}")
             else:
                 st.info("✅ No hay notificaciones pendientes en este momento")
 
 # Mostrar tabla y funciones adicionales
 if uploaded_file and not df.empty:
+    with METRICS.timed("ui_render", view="results"):
+        render_results()
+    
     st.header("📋 Vista Previa de Citas")
     
     # Filtros
-    col1, col2 = st.columns(2)
+    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
     with col1:
         filter_notificado = st.selectbox("Filtrar por estado:", ["Todos", "Notificados", "Pendientes"])
     with col2:
         filter_cambio = st.selectbox("Filtrar por cambios:", ["Todos", "Con cambios", "Sin cambios"])
     
     # Aplicar filtros
-    filtered_df = df.copy()
-    if filter_notificado == "Notificados":
-        filtered_df = filtered_df[filtered_df['¿NOTIFICADO?'] == True]
-    elif filter_notificado == "Pendientes":
-        filtered_df = filtered_df[filtered_df['¿NOTIFICADO?'] != True]
-    
-    if filter_cambio == "Con cambios":
-        filtered_df = filtered_df[filtered_df['¿CAMBIO DE HORA?'] == True]
-    elif filter_cambio == "Sin cambios":
-        filtered_df = filtered_df[filtered_df['¿CAMBIO DE HORA?'] != True]
-    
-    st.dataframe(filtered_df, use_container_width=True)
-
-    # Mostrar logs si se solicitó
-    if show_logs:
-        st.header("📋 Registro de Notificaciones")
-        log_file = "notification_log.json"
-        if os.path.exists(log_file):
-            try:
-                with open(log_file, "r", encoding='utf-8') as f:
-                    logs = json.load(f)
-                if logs:
-                    logs_df = pd.DataFrame(logs)
-                    st.dataframe(logs_df, use_container_width=True)
-                else:
-                    st.info("No hay registros de notificaciones aún")
-            except Exception as e:
-                st.error(f"Error al cargar logs: {str(e)}")
-        else:
-            st.info("No hay archivo de logs disponible")
-
-    # Descargar Excel actualizado
+    # Una sola máscara booleana; sin filtros se muestra el frame tal cual, sin copiarlo
+    mask = None
+    if filter_notificado != "Todos":
+        notified = is_set(df['¿NOTIFICADO?'])
+        mask = notified if filter_notificado == "Notificados" else ~notified
+    if filter_cambio != "Todos":
+        changed = is_set(df['¿CAMBIO DE HORA?'])
+        changed = changed if filter_cambio == "Con cambios" else ~changed
+        mask = changed if mask is None else mask & changed
+    
+    # Sólo la página visible se serializa y viaja al navegador en cada rerun
+    view = df if mask is None else df[mask]
+    with col3:
+        page_size = st.selectbox("Filas por página:", PREVIEW_PAGE_SIZES, index=2, key="preview_page_size")
+    pages = max(1, -(-len(view) // page_size))
+    with col4:
+        page = st.number_input(f"Página (de {pages}):", min_value=1, max_value=pages, value=1, key="preview_page")
+    with METRICS.timed("ui_render", view="preview"):
+        st.dataframe(view.iloc[(page - 1) * page_size:page * page_size], use_container_width=True)
+    st.caption(f"{len(view)} citas")
+
+    # Descargar datos actualizados: el archivo se genera sólo a pedido y se
+    # reutiliza mientras el DataFrame de la sesión no cambie
     if 'df' in st.session_state:
-        output = io.BytesIO()
-        try:
-            with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                st.session_state.df.to_excel(writer, index=False, sheet_name='Citas_Actualizadas')
-            
-            st.download_button(
-                "💾 Descargar Datos Actualizados",
-                data=output.getvalue(),
-                file_name=f"citas_actualizadas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.ms-excel"
-            )
-        except Exception as e:
-            st.error(f"Error al generar archivo de descarga: {str(e)}")
+        st.header("💾 Descargar Datos Actualizados")
+        col1, col2 = st.columns([2, 1])
+        with col1:
+            export_format = st.radio("Formato:", list(EXPORT_FORMATS), horizontal=True,
+                                     format_func=lambda f: EXPORT_FORMATS[f][0])
+        label, extension, mime = EXPORT_FORMATS[export_format]
+        export_key = (st.session_state.get('df_version', 0), export_format)
+        cached = st.session_state.get('export_file')
+        with col2:
+            if cached is None or cached[0] != export_key:
+                if st.button("📦 Preparar descarga"):
+                    try:
+                        with st.spinner("Generando archivo..."):
+                            # Se suelta el archivo anterior antes de generar el nuevo
+                            st.session_state.export_file = None
+                            data = export_bytes(st.session_state.df, export_format)
+                        file_name = f"citas_actualizadas_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+                        st.session_state.export_file = cached = (export_key, file_name, data)
+                    except Exception as e:
+                        st.error(f"Error al generar archivo de descarga: {str(e)}")
+            if cached is not None and cached[0] == export_key:
+                st.download_button(f"💾 Descargar {label}", data=cached[2], file_name=cached[1], mime=mime)
 else:
     st.info("👆 Por favor, sube un archivo Excel para comenzar")
 
+# Mostrar logs si se solicitó
+if st.session_state.get('show_logs'):
+    with METRICS.timed("ui_render", view="logs"):
+        render_logs()
+
 # Pie de página
 st.markdown("---")
 st.markdown('<div style="text-align:center;color:#666;"><p>Sistema de Notificaciones Médicas - Desarrollado para análisis y gestión de datos médicos</p></div>', unsafe_allow_html=True)
@@ -766,12 +757,17 @@ with st.container():
             </div>
         """, unsafe_allow_html=True)
 
+METRICS.observe("ui_run", time.perf_counter() - _run_started)
+if METRICS.enabled:
+    METRICS.write_textfile()
+
 # Cleanup on app close
 import atexit
 
 def cleanup():
-    """Clean up selenium driver on app close"""
-    if 'whatsapp_selenium' in st.session_state:
-        st.session_state.whatsapp_selenium.close()
+    """Clean up selenium driver and pending log writes on app close"""
+    get_notification_log().close()
+    for client in get_selenium_clients().values():
+        client.close()
 
 atexit.register(cleanup)
\ No newline at end of file
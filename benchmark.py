@@ -0,0 +1,307 @@
+"""Offline benchmark suite: synthetic agendas, per-stage timings and end-to-end headless runs
+
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python benchmark.py --sizes 1000000 --repeat 1 --compare bench.json
+
+Synthetic agendas are generated once per size and seed under bench_data/ and
+reused, so two runs with the same arguments time the same input. Results are
+written as JSON; --compare prints the ratio against an earlier file and exits
+with 1 when a stage got slower than --threshold.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from agenda import REQUIRED_COLUMNS, select_changes, select_reminders, window_bounds
+from export import export_agenda
+from gateway_sim import GatewaySimulator
+from messages import (create_change_message, create_reminder_message, render_change_messages,
+                      render_reminder_messages)
+from metrics import METRICS
+from notification_log import NotificationLog
+from notification_store import NotificationStore
+from notificaciones import load_data, make_log_entry, save_log
+from upload_cache import UploadCache, content_digest
+
+BENCH_DIR = "bench_data"
+DEFAULT_SIZES = [1_000, 10_000, 100_000]  # 1_000_000 a pedido: sólo generarlo toma minutos
+SAVE_LOG_LIMIT = 5_000
+
+FIRST_NAMES = ["María", "José", "Juan", "Ana", "Luis", "Carmen", "Pedro", "Rosa", "Jorge", "Elena",
+               "Francisco", "Isabel", "Manuel", "Patricia", "Héctor", "Sofía"]
+LAST_NAMES = ["González", "Muñoz", "Rojas", "Díaz", "Pérez", "Soto", "Contreras", "Silva", "Martínez",
+              "Sepúlveda", "Morales", "Rodríguez", "López", "Fuentes", "Hernández", "Antinao"]
+PROFESSIONALS = ["Dr. Soto", "Dra. Pérez", "Dr. Rojas", "Dra. Muñoz", "Matrona Díaz", "Enf. Silva",
+                 "Nutricionista Vera", "Kinesiólogo Lagos"]
+REASONS = ["Control crónico", "Control sano", "Dental", "Vacunación", "Curación", "Toma de muestras",
+           "Control prenatal", "Salud mental"]
+
+
+# Agendas sintéticas
+def generate_agenda(rows, seed=0, today=None):
+    """Agenda with the load_data columns and a realistic mix of states
+
+    Appointments spread over ±30 days (about 1/30 of them fall in the two-day
+    window), 30% already notified, 5% rescheduled, 3% invalid phones and part
+    of the valid ones written as '+56 9 XXXX XXXX'.
+    """
+    rng = np.random.default_rng(seed)
+    today = datetime.combine(today or datetime.now().date(), datetime.min.time())
+    ids = np.arange(rows)
+
+    minutes = rng.integers(8 * 4, 17 * 4, rows) * 15
+    fecha = (pd.Timestamp(today) + pd.to_timedelta(rng.integers(-30, 31, rows), unit="D")
+             + pd.to_timedelta(minutes, unit="m"))
+
+    numbers = rng.integers(10_000_000, 100_000_000, rows).astype(str)
+    phones = pd.Series(np.char.add("9", numbers), dtype=object)
+    formatted = rng.random(rows) < 0.2
+    phones[formatted] = "+56 9 " + phones[formatted].str[1:5] + " " + phones[formatted].str[5:]
+    invalid = rng.random(rows) < 0.03
+    phones[invalid] = phones[invalid].str[:6]
+
+    changed = rng.random(rows) < 0.05
+    notified = ~changed & (rng.random(rows) < 0.3)
+    nueva = fecha + pd.to_timedelta(rng.integers(1, 8, rows), unit="D")
+
+    df = pd.DataFrame({
+        "RUT": pd.Series(ids + 10_000_000).astype(str) + "-" + pd.Series(ids % 10).astype(str),
+        "NOMBRE_PACIENTE": (np.array(FIRST_NAMES, dtype=object)[rng.integers(0, len(FIRST_NAMES), rows)] + " "
+                            + np.array(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), rows)] + " "
+                            + np.array(LAST_NAMES, dtype=object)[rng.integers(0, len(LAST_NAMES), rows)]),
+        "TELEFONO": phones,
+        "FECHA_ATENCION": fecha,
+        "MOTIVO_CONSULTA": np.array(REASONS, dtype=object)[rng.integers(0, len(REASONS), rows)],
+        "PROFESIONAL": np.array(PROFESSIONALS, dtype=object)[rng.integers(0, len(PROFESSIONALS), rows)],
+        "¿NOTIFICADO?": np.where(notified, True, None),
+        "¿CAMBIO DE HORA?": np.where(changed, True, None),
+        "NUEVA_FECHA": pd.Series(nueva).where(changed),
+        "PROFESIONAL_REASIGNADO": np.where(
+            changed, np.array(PROFESSIONALS, dtype=object)[rng.integers(0, len(PROFESSIONALS), rows)], None),
+    })
+    return df[REQUIRED_COLUMNS]
+
+
+def agenda_file(rows, seed=0, fmt="xlsx", bench_dir=BENCH_DIR):
+    """Path of the synthetic agenda for (rows, seed, fmt), generating it the first time
+
+    The file is tied to the day it was generated on (the window moves with
+    the date), so a stale file from another day is rebuilt.
+    """
+    os.makedirs(bench_dir, exist_ok=True)
+    day = datetime.now().strftime("%Y%m%d")
+    path = os.path.abspath(os.path.join(bench_dir, f"agenda_{rows}_s{seed}_{day}.{fmt}"))
+    if not os.path.exists(path):
+        tmp_path = f"{path}.tmp.{fmt}"
+        export_agenda(generate_agenda(rows, seed), fmt, tmp_path)
+        os.replace(tmp_path, path)
+    return path
+
+
+# Medición
+def _timed(fn, repeat):
+    """Run `fn` `repeat` times; returns (seconds of each run, last result)"""
+    runs = []
+    result = None
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        result = fn()
+        runs.append(time.perf_counter() - started)
+    return runs, result
+
+
+def _row(rows, stage, runs, **extra):
+    return {"rows": rows, "stage": stage, "seconds": round(statistics.median(runs), 6),
+            "min": round(min(runs), 6), "runs": len(runs), **extra}
+
+
+@contextlib.contextmanager
+def _scratch_dir():
+    """Temporary working directory, so logs, checkpoints and databases start empty"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_") as path:
+        os.chdir(path)
+        try:
+            yield path
+        finally:
+            os.chdir(previous)
+
+
+def bench_stages(path, rows, repeat):
+    """Time ingestion, window selection, message rendering, save_log and the xlsx export"""
+    results = []
+
+    runs, (df, date_index) = _timed(lambda: load_data(path), repeat)
+    results.append(_row(rows, "ingest", runs))
+
+    with _scratch_dir():
+        cache = UploadCache()
+        digest = content_digest(path)
+        load_data(path, cache, digest)
+        runs, _ = _timed(lambda: load_data(path, cache, digest), repeat)
+    results.append(_row(rows, "ingest_cached", runs))
+
+    today, target_date = window_bounds(datetime.now().date())
+    runs, (reminders, changes) = _timed(
+        lambda: (select_reminders(df, date_index, today, target_date),
+                 select_changes(df, date_index, today, target_date)), repeat)
+    results.append(_row(rows, "select", runs, reminders=len(reminders), changes=len(changes)))
+
+    runs, (reminder_messages, change_messages) = _timed(
+        lambda: (render_reminder_messages(reminders), render_change_messages(changes)), repeat)
+    results.append(_row(rows, "render_vectorized", runs, messages=len(reminders) + len(changes)))
+
+    runs, _ = _timed(lambda: ([create_reminder_message(row) for _, row in reminders.iterrows()],
+                              [create_change_message(row) for _, row in changes.iterrows()]), repeat)
+    results.append(_row(rows, "render_rowwise", runs, messages=len(reminders) + len(changes)))
+
+    entries = [make_log_entry(row, "Recordatorio", "api_link", reminder_messages[idx], True, "ok")
+               for idx, row in reminders.head(SAVE_LOG_LIMIT).iterrows()]
+    with _scratch_dir():
+        log = NotificationLog()
+        store = NotificationStore()
+
+        def write_entries():
+            for entry in entries:
+                save_log(entry, log, store)
+            log.flush()
+        runs, _ = _timed(write_entries, repeat)
+        log.close()
+    results.append(_row(rows, "save_log", runs, entries=len(entries),
+                        ms_per_entry=round(1000 * statistics.median(runs) / max(1, len(entries)), 4)))
+
+    with _scratch_dir():
+        runs, _ = _timed(lambda: export_agenda(df, "xlsx", "export.xlsx"), 1)
+        size = os.path.getsize("export.xlsx")
+    results.append(_row(rows, "export_xlsx", runs, mb=round(size / 1024 ** 2, 2)))
+    return results
+
+
+def bench_end_to_end(path, rows, method, webhook_url=None, batch_size=0):
+    """One run_headless campaign over `path` in an empty directory, with the per-stage metrics it recorded"""
+    import run_headless
+
+    argv = [path, "--method", method, "--rate", "1000000", "--burst", "1000000", "--no-cache",
+            "--metrics-file", "metrics.prom"]
+    if webhook_url:
+        argv += ["--webhook-url", webhook_url]
+    if batch_size:
+        argv += ["--batch-size", str(batch_size)]
+    METRICS.reset()
+    with _scratch_dir():
+        out = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(io.StringIO()):
+            exit_code = run_headless.main(argv)
+        seconds = time.perf_counter() - started
+    snapshot = METRICS.snapshot()
+    METRICS.enabled = False
+    sends = sum(s["n"] for s in snapshot if s["etapa"] == "save_log")
+    stage = f"e2e_{method}" + (f"_batch{batch_size}" if batch_size else "")
+    return _row(rows, stage, [seconds], exit_code=exit_code, sends=sends,
+                sends_per_s=round(sends / seconds, 1) if seconds else None,
+                stages={f"{s['etapa']}{' ' + s['etiquetas'] if s['etiquetas'] else ''}": s["total_s"]
+                        for s in snapshot})
+
+
+def run_suite(sizes, repeat=3, seed=0, fmt="xlsx", end_to_end=True, bench_dir=BENCH_DIR, log=print):
+    results = []
+    for rows in sizes:
+        started = time.perf_counter()
+        path = agenda_file(rows, seed, fmt, bench_dir)
+        log(f"{rows} filas: agenda lista en {time.perf_counter() - started:.1f} s ({os.path.basename(path)})")
+        for result in bench_stages(path, rows, repeat):
+            results.append(result)
+            log(f"  {result['stage']:<20} {result['seconds']:>10.4f} s")
+        if end_to_end:
+            with GatewaySimulator() as gateway:
+                url = gateway.url
+                # run_headless rechaza api_link: las campañas completas van por el gateway simulado
+                for method, kwargs in (("webhook", {"webhook_url": url}),
+                                       ("webhook", {"webhook_url": url, "batch_size": 50})):
+                    result = bench_end_to_end(path, rows, method, **kwargs)
+                    results.append(result)
+                    log(f"  {result['stage']:<20} {result['seconds']:>10.4f} s  "
+                        f"({result['sends']} envíos, {result['sends_per_s']}/s)")
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(current, baseline, threshold=0.2):
+    """Print new/old ratios for stages present in both runs; returns the regressed (rows, stage) pairs"""
+    previous = {(r["rows"], r["stage"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    print(f"{'filas':>9}  {'etapa':<20} {'antes':>10} {'ahora':>10} {'razón':>7}")
+    for r in current["results"]:
+        old = previous.get((r["rows"], r["stage"]))
+        if not old:
+            continue
+        ratio = r["seconds"] / old
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  ⚠ más lento"
+            regressions.append((r["rows"], r["stage"]))
+        print(f"{r['rows']:>9}  {r['stage']:<20} {old:>10.4f} {r['seconds']:>10.4f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks sin conexión del flujo de notificaciones")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="filas de cada agenda sintética (p. ej. 1000 10000 100000 1000000)")
+    parser.add_argument("--repeat", type=int, default=3, help="repeticiones de cada etapa (se informa la mediana)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", default="xlsx", choices=["xlsx", "csv"], help="formato de las agendas generadas")
+    parser.add_argument("--no-e2e", action="store_true", help="omitir las campañas completas")
+    parser.add_argument("--output", default=f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    parser.add_argument("--compare", help="resultado JSON anterior contra el cual comparar")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="fracción de aumento sobre la que una etapa cuenta como regresión")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {"environment": environment(),
+              "config": {"sizes": args.sizes, "repeat": args.repeat, "seed": args.seed, "format": args.format},
+              "results": run_suite(args.sizes, args.repeat, args.seed, args.format, not args.no_e2e)}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Resultados en {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from result_buffer import ResultBuffer
+
+CHECKPOINT_DIR = "checkpoints"
+
+
+def _key_text(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return ""
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def checkpoint_key(rut, fecha_atencion, tipo):
+    """Journal key of one notification: (RUT, FECHA_ATENCION, message type)"""
+    return (_key_text(rut), _key_text(fecha_atencion), tipo)
+
+
+class CampaignCheckpoint:
+    """Durable progress journal of a campaign, replayed into a dict for O(1) resume checks
+
+    Each completed send is one JSON line; fsync is batched like NotificationLog,
+    so a crash loses at most the last unsynced batch of journal lines.
+    """
+
+    def __init__(self, name, checkpoint_dir=CHECKPOINT_DIR, fsync_every=50, fsync_interval=2.0):
+        self.path = os.path.join(checkpoint_dir, f"{name}.jsonl")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        self.completed = {}
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self._replay()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # última línea cortada por una caída
+                self.completed[(entry["rut"], entry["fecha_atencion"], entry["type"])] = entry
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def __len__(self):
+        return len(self.completed)
+
+    def is_done(self, rut, fecha_atencion, tipo):
+        return checkpoint_key(rut, fecha_atencion, tipo) in self.completed
+
+    def record(self, rut, fecha_atencion, tipo, method, timestamp=None):
+        """Journal one completed send"""
+        key = checkpoint_key(rut, fecha_atencion, tipo)
+        entry = {"rut": key[0], "fecha_atencion": key[1], "type": tipo, "method": method,
+                 "timestamp": timestamp or datetime.now().isoformat()}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.completed[key] = entry
+            self._file.write(line)
+            self._pending += 1
+            if (self._pending >= self.fsync_every or
+                    time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def clear(self):
+        """Forget the campaign's progress so the next run starts from scratch"""
+        with self._lock:
+            self._file.close()
+            self.completed = {}
+            self._pending = 0
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._sync()
+
+    def apply(self, df):
+        """Write journaled sends back into `df` (e.g. after a crash); returns the rows restored"""
+        if not self.completed:
+            return 0
+        buffer = ResultBuffer(df, flush_every=len(df) * 2 + 1)
+        ruts = {key[0] for key in self.completed}
+        for idx, rut, fecha in zip(df.index, df['RUT'], df['FECHA_ATENCION']):
+            if _key_text(rut) not in ruts:
+                continue
+            for tipo in ("Recordatorio", "Cambio de Cita"):
+                entry = self.completed.get(checkpoint_key(rut, fecha, tipo))
+                if entry is not None:
+                    buffer.add(idx, tipo, True, entry["timestamp"], entry["method"])
+        return buffer.flush()
@@ -0,0 +1,177 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+
+from rate_limiter import SendResult, is_backpressure, is_timeout
+
+
+def build_session(pool_size=8):
+    """HTTP session with a keep-alive connection pool sized for `pool_size` in-flight requests"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class Dispatcher:
+    """Run `send_fn(phone, message)` over many jobs with up to `max_workers` in flight"""
+
+    def __init__(self, send_fn, max_workers=1, limiter=None):
+        self.send_fn = send_fn
+        self.max_workers = max(1, int(max_workers))
+        self.limiter = limiter
+        # Envíos en vuelo o en cola como máximo: lo que queda sin enviar al cerrar run() no sale
+        self.window = 2 * self.max_workers
+
+    def _send(self, phone, message):
+        if self.limiter:
+            self.limiter.acquire()
+        try:
+            success, result = self.send_fn(phone, message)
+        except Exception as e:
+            success, result = False, SendResult(f"Error de envío: {str(e)}", backpressure=is_timeout(e))
+        if self.limiter:
+            self.limiter.record(success, result)
+        return success, result
+
+    def run(self, jobs, drain=None):
+        """Yield (key, success, result) for each (key, phone, message) job as it completes
+
+        With a single worker the jobs run inline on the caller's thread, so send
+        functions that rely on Streamlit session state keep working. Otherwise
+        jobs are pulled lazily, at most `window` in flight or queued; closing the
+        generator cancels the queued ones, waits for those already sending and
+        passes their outcomes to `drain(key, success, result)`.
+        """
+        if self.max_workers == 1:
+            for key, phone, message in jobs:
+                success, result = self._send(phone, message)
+                yield key, success, result
+            return
+
+        jobs = iter(jobs)
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = {}
+
+        def submit(count):
+            for key, phone, message in islice(jobs, count):
+                pending[executor.submit(self._send, phone, message)] = key
+
+        try:
+            submit(self.window)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = pending.pop(future)
+                    # Reponer antes de ceder el resultado, para que los workers no esperen al consumidor
+                    submit(1)
+                    success, result = future.result()
+                    yield key, success, result
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+            if drain is not None:
+                for future, key in pending.items():
+                    if not future.cancelled():
+                        drain(key, *future.result())
+
+
+class BatchDispatcher:
+    """Group jobs into array payloads sent through `send_batch_fn(items)`
+
+    A batch is posted once it holds `batch_size` jobs or its first job has waited
+    `max_linger` seconds. `send_batch_fn` receives a list of (phone, message) and
+    returns one (success, result) per item, in the same order.
+    """
+
+    def __init__(self, send_batch_fn, batch_size=50, max_linger=0.5, max_workers=1, limiter=None):
+        self.send_batch_fn = send_batch_fn
+        self.limiter = limiter
+        self.batch_size = max(1, int(batch_size))
+        self.max_linger = max(0.0, float(max_linger))
+        self.max_workers = max(1, int(max_workers))
+        # Lotes en vuelo o en cola como máximo
+        self.window = 2 * self.max_workers
+
+    def _send(self, batch):
+        if self.limiter:
+            self.limiter.acquire(len(batch))
+        try:
+            outcomes = self.send_batch_fn([(phone, message) for _, phone, message in batch])
+        except Exception as e:
+            outcomes = [(False, SendResult(f"Error de envío: {str(e)}", backpressure=is_timeout(e)))] * len(batch)
+        outcomes = list(outcomes) + [(False, "Sin respuesta en el lote")] * (len(batch) - len(outcomes))
+        if self.limiter:
+            throttled = [o for o in outcomes if is_backpressure(o[1])]
+            self.limiter.record(*(throttled[0] if throttled else outcomes[0]))
+        return [(key, success, result)
+                for (key, _, _), (success, result) in zip(batch, outcomes)]
+
+    def run(self, jobs, drain=None):
+        """Yield (key, success, result) per job, batch by batch as responses arrive
+
+        At most `window` batches are in flight or queued; closing the generator
+        cancels the queued ones, waits for those already posted, stops reading
+        `jobs` and passes every outcome not yet yielded to `drain(key, success, result)`.
+        """
+        source = queue.Queue()
+        stop = threading.Event()
+
+        def feed():
+            for job in jobs:
+                if stop.is_set():
+                    return
+                source.put(job)
+            source.put(None)
+
+        threading.Thread(target=feed, daemon=True).start()
+
+        batch, deadline, finished = [], None, False
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        pending = set()
+        outcomes = deque()
+        try:
+            while True:
+                if not finished and len(batch) < self.batch_size:
+                    timeout = 0.05 if deadline is None else min(0.05, max(0.0, deadline - time.monotonic()))
+                    try:
+                        job = source.get(timeout=timeout)
+                    except queue.Empty:
+                        job = False
+                    if job is None:
+                        finished = True
+                    elif job:
+                        batch.append(job)
+                        if deadline is None:
+                            deadline = time.monotonic() + self.max_linger
+
+                ready = bool(batch) and (finished or len(batch) >= self.batch_size or time.monotonic() >= deadline)
+                if ready and len(pending) < self.window:
+                    pending.add(executor.submit(self._send, batch))
+                    batch, deadline, ready = [], None, False
+
+                # Con la ventana llena o sin más trabajos, esperar a que termine algún lote
+                if ready or (finished and not batch):
+                    if not pending:
+                        break
+                    wait(pending, return_when=FIRST_COMPLETED)
+                for future in [f for f in pending if f.done()]:
+                    pending.remove(future)
+                    outcomes.extend(future.result())
+                while outcomes:
+                    yield outcomes.popleft()
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            if drain is not None:
+                for future in pending:
+                    if not future.cancelled():
+                        outcomes.extend(future.result())
+                for outcome in outcomes:
+                    drain(*outcome)
@@ -0,0 +1,69 @@
+import importlib.util
+import os
+import tempfile
+
+# pandas importa pyarrow al escribir Parquet; aquí sólo se comprueba que exista
+PARQUET_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+SHEET_NAME = 'Citas_Actualizadas'
+
+# formato -> (etiqueta, extensión, MIME)
+EXPORT_FORMATS = {
+    "xlsx": ("Excel (.xlsx)", "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv": ("CSV (;)", "csv", "text/csv"),
+}
+if PARQUET_AVAILABLE:
+    EXPORT_FORMATS["parquet"] = ("Parquet", "parquet", "application/vnd.apache.parquet")
+
+
+def _cell_values(column):
+    """Column as Python objects with None for every kind of missing value"""
+    values = column.astype(object)
+    return values.where(column.notna(), None).to_numpy()
+
+
+def write_xlsx(df, path):
+    """Stream `df` to an xlsx file row by row in xlsxwriter's constant_memory mode"""
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True,
+                                          'default_date_format': 'dd/mm/yyyy hh:mm',
+                                          'remove_timezone': True})
+    try:
+        sheet = workbook.add_worksheet(SHEET_NAME)
+        sheet.write_row(0, 0, [str(c) for c in df.columns], workbook.add_format({'bold': True}))
+        columns = [_cell_values(df[c]) for c in df.columns]
+        for r, row in enumerate(zip(*columns), start=1):
+            sheet.write_row(r, 0, row)
+    finally:
+        workbook.close()
+
+
+def export_agenda(df, fmt, path):
+    """Write the agenda to `path` as xlsx, csv or parquet"""
+    if fmt == "xlsx":
+        write_xlsx(df, path)
+    elif fmt == "csv":
+        # ';' y BOM para que Excel en español lo abra directamente
+        df.to_csv(path, index=False, sep=';', encoding='utf-8-sig')
+    elif fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        raise ValueError(f"Formato de exportación no soportado: {fmt}")
+
+
+def export_bytes(df, fmt):
+    """Export through a temporary file, so only the finished file is held in memory"""
+    fd, path = tempfile.mkstemp(suffix=f".{EXPORT_FORMATS[fmt][1]}")
+    os.close(fd)
+    try:
+        export_agenda(df, fmt, path)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
+
+
+def format_for_path(path):
+    ext = os.path.splitext(str(path))[1].lower().lstrip('.')
+    return ext if ext in EXPORT_FORMATS else "xlsx"
@@ -0,0 +1,267 @@
+"""Local stand-in for a WhatsApp gateway, for load testing the webhook and link paths
+
+    python gateway_sim.py --port 8765 --latency 0.05 --jitter 0.02 --error-rate 0.01 --rate 50
+
+Accepts the payloads WhatsAppAPI sends (one {"phone", "message", "timestamp"}
+object, or a list of them in batch mode) plus GET /send?phone=...&text=... as
+produced by send_via_api_link. GET /stats returns the receipt summary as JSON
+and POST /reset clears it.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PHONE_PATTERN = re.compile(r"\+?569\d{8}")
+
+
+class _Throttle:
+    """Non-blocking token bucket: a request either takes its tokens now or is throttled"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, n=1):
+        """Returns 0 when admitted, else the seconds until `n` tokens are available"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return 0.0
+            return (n - self.tokens) / self.rate
+
+
+class GatewaySimulator:
+    """Threaded HTTP gateway with configurable latency, failures and 429 throttling
+
+    latency + uniform(0, jitter) seconds are spent on every request (plus
+    `item_latency` per message of a batch). `error_rate` fails that fraction of
+    messages: whole requests with a 500 for single sends, individual items in a
+    batch response. With `rate` set, requests over that many messages per
+    second get a 429 with Retry-After. Each message is recorded as a receipt
+    (received_at, phone, status).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, item_latency=0.0,
+                 error_rate=0.0, rate=None, burst=None, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.item_latency = item_latency
+        self.error_rate = error_rate
+        self.throttle = _Throttle(rate, burst) if rate else None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._receipts = []
+        self._requests = 0
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    # Ciclo de vida
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Simulación
+    def _delay(self, items=1):
+        with self._lock:
+            jitter = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        seconds = self.latency + jitter + self.item_latency * items
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _fails(self):
+        if not self.error_rate:
+            return False
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _record(self, received_at, phones, statuses):
+        with self._lock:
+            self._requests += 1
+            self._receipts.extend(zip([received_at] * len(phones), phones, statuses))
+
+    def handle(self, payload, received_at):
+        """(status code, JSON body, headers) for one webhook payload"""
+        batch = isinstance(payload, list)
+        items = payload if batch else [payload]
+        if not items or not all(isinstance(i, dict) and isinstance(i.get("phone"), str)
+                                and isinstance(i.get("message"), str) for i in items):
+            self._record(received_at, [None], ["rechazado"])
+            return 400, {"error": "payload inválido: se esperan objetos con phone y message"}, {}
+        phones = [i["phone"] for i in items]
+        if self.throttle is not None:
+            retry_after = self.throttle.take(len(items))
+            if retry_after:
+                self._record(received_at, phones, ["429"] * len(items))
+                return 429, {"error": "rate limit"}, {"Retry-After": f"{max(1, round(retry_after))}"}
+        self._delay(len(items))
+        if not batch:
+            if self._fails():
+                self._record(received_at, phones, ["error"])
+                return 500, {"error": "fallo simulado"}, {}
+            if not PHONE_PATTERN.fullmatch(phones[0]):
+                self._record(received_at, phones, ["error"])
+                return 422, {"error": "numero invalido"}, {}
+            self._record(received_at, phones, ["ok"])
+            return 200, {"ok": True, "received_at": received_at}, {}
+        results, statuses = [], []
+        for index, phone in enumerate(phones):
+            if not PHONE_PATTERN.fullmatch(phone):
+                error = "numero invalido"
+            elif self._fails():
+                error = "fallo simulado"
+            else:
+                error = None
+            statuses.append("error" if error else "ok")
+            results.append({"index": index, "success": True} if error is None
+                           else {"index": index, "success": False, "error": error})
+        self._record(received_at, phones, statuses)
+        return 200, {"results": results, "received_at": received_at}, {}
+
+    def handle_link(self, query, received_at):
+        """Check a wa.me style link (phone digits and URL-encoded text) as opened by a user"""
+        params = parse_qs(query)
+        phone = params.get("phone", [""])[0]
+        text = params.get("text", [""])[0]
+        ok = bool(PHONE_PATTERN.fullmatch("+" + phone) and text)
+        self._delay()
+        self._record(received_at, ["+" + phone], ["ok" if ok else "error"])
+        if not ok:
+            return 400, {"error": "link inválido"}, {}
+        return 200, {"ok": True, "chars": len(text)}, {}
+
+    # Recibos
+    def receipts(self):
+        with self._lock:
+            return list(self._receipts)
+
+    def reset(self):
+        with self._lock:
+            self._receipts = []
+            self._requests = 0
+
+    def stats(self):
+        """Requests, messages by status and the accepted rate between the first and last receipt"""
+        with self._lock:
+            receipts = list(self._receipts)
+            requests = self._requests
+        by_status = {}
+        for _, _, status in receipts:
+            by_status[status] = by_status.get(status, 0) + 1
+        accepted = [t for t, _, status in receipts if status == "ok"]
+        span = max(accepted) - min(accepted) if len(accepted) > 1 else 0.0
+        return {
+            "requests": requests,
+            "messages": len(receipts),
+            "by_status": by_status,
+            "accepted_per_s": round((len(accepted) - 1) / span, 1) if span else None,
+            "first_receipt": min(t for t, _, _ in receipts) if receipts else None,
+            "last_receipt": max(t for t, _, _ in receipts) if receipts else None,
+        }
+
+    def _handler_class(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Cabeceras y cuerpo en un solo segmento: sin esto Nagle + ACK retardado suman ~40 ms por respuesta
+            wbufsize = 64 * 1024
+            disable_nagle_algorithm = True
+
+            def _reply(self, status, body, headers=None):
+                data = json.dumps(body, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                received_at = time.time()
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if urlsplit(self.path).path == "/reset":
+                    simulator.reset()
+                    return self._reply(200, {"ok": True})
+                try:
+                    payload = json.loads(raw)
+                except ValueError:
+                    return self._reply(400, {"error": "JSON inválido"})
+                self._reply(*simulator.handle(payload, received_at))
+
+            def do_GET(self):
+                received_at = time.time()
+                parts = urlsplit(self.path)
+                if parts.path == "/stats":
+                    return self._reply(200, simulator.stats())
+                if parts.path == "/send":
+                    return self._reply(*simulator.handle_link(parts.query, received_at))
+                self._reply(404, {"error": "no encontrado"})
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gateway de WhatsApp simulado para pruebas de carga")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="segundos fijos por solicitud")
+    parser.add_argument("--jitter", type=float, default=0.0, help="segundos aleatorios adicionales (uniforme)")
+    parser.add_argument("--item-latency", type=float, default=0.0, help="segundos extra por mensaje de un lote")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de mensajes que fallan")
+    parser.add_argument("--rate", type=float, help="mensajes por segundo admitidos antes de responder 429")
+    parser.add_argument("--burst", type=float, help="ráfaga admitida (por defecto, un segundo de --rate)")
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    simulator = GatewaySimulator(args.host, args.port, args.latency, args.jitter, args.item_latency,
+                                 args.error_rate, args.rate, args.burst, args.seed)
+    print(f"Gateway simulado en {simulator.url} (Ctrl+C para detener)")
+    try:
+        simulator.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(simulator.stats(), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from notification_store import DB_FILE
+
+DEFAULT_TTL = 30 * 24 * 3600
+# Un envío reclamado y no confirmado (p. ej. el proceso murió) se libera tras este plazo
+CLAIM_LEASE = 15 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency (
+    key BLOB PRIMARY KEY,
+    expires_at REAL NOT NULL,
+    confirmed INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_idempotency_expires ON idempotency(expires_at);
+"""
+
+
+def idempotency_key(rut, phone, fecha_atencion, tipo, message):
+    """16-byte hash of (RUT, phone, appointment date, message type, message hash)"""
+    message_hash = hashlib.blake2b(str(message).encode("utf-8"), digest_size=16).hexdigest()
+    parts = (str(rut), str(phone), str(fecha_atencion), str(tipo), message_hash)
+    return hashlib.blake2b("\x1f".join(parts).encode("utf-8"), digest_size=16).digest()
+
+
+class IdempotencyIndex:
+    """Persistent set of sent notifications with a TTL, consulted before every dispatch
+
+    Keys live in a WITHOUT ROWID primary-key table, so lookups are a single
+    B-tree probe no matter how many millions of sends accumulate.
+    """
+
+    def __init__(self, db_path=DB_FILE, ttl=DEFAULT_TTL, lease=CLAIM_LEASE):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.lease = lease
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.purge()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def _live(self, keys, now):
+        live = set()
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            live.update(row[0] for row in self.conn.execute(
+                f"SELECT key FROM idempotency WHERE key IN ({placeholders}) AND expires_at > ?",
+                (*chunk, now)))
+        return live
+
+    def seen(self, key):
+        with self._lock:
+            return bool(self._live([key], time.time()))
+
+    def claim(self, keys):
+        """Reserve the keys that are not live yet and return them; the rest are duplicates
+
+        The check and the reservation run in one IMMEDIATE transaction, so two
+        processes working on the same agenda cannot both claim a send.
+        """
+        now = time.time()
+        # Filas repetidas dentro de la misma agenda dan la misma clave: se reserva una sola vez
+        keys = list(dict.fromkeys(keys))
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                live = self._live(keys, now)
+                claimed = [key for key in keys if key not in live]
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO idempotency (key, expires_at, confirmed) VALUES (?, ?, 0)",
+                    ((key, now + self.lease) for key in claimed))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+        return set(claimed)
+
+    def confirm(self, key):
+        """Mark a claimed send as delivered for the full TTL"""
+        with self._lock:
+            self.conn.execute("UPDATE idempotency SET expires_at = ?, confirmed = 1 WHERE key = ?",
+                              (time.time() + self.ttl, key))
+
+    def release(self, key):
+        """Drop a claim whose send failed so it can be retried"""
+        with self._lock:
+            self.conn.execute("DELETE FROM idempotency WHERE key = ? AND confirmed = 0", (key,))
+
+    def release_many(self, keys):
+        """release() for many keys in one transaction, e.g. the jobs of an interrupted run"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany("DELETE FROM idempotency WHERE key = ? AND confirmed = 0",
+                                      ((key,) for key in keys))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def purge(self):
+        """Delete expired entries; returns how many were removed"""
+        with self._lock:
+            return self.conn.execute("DELETE FROM idempotency WHERE expires_at <= ?",
+                                     (time.time(),)).rowcount
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM idempotency")
@@ -0,0 +1,206 @@
+"""Load driver for the webhook and link send paths, against gateway_sim or any compatible URL
+
+    python load_test.py --messages 5000 --concurrency 16 --latency 0.05 --gateway-rate 200 --retries 2
+    python load_test.py --url http://127.0.0.1:8765/ --messages 20000 --batch-size 50 --output carga.json
+
+Without --url a GatewaySimulator is started in-process with the given
+latency, error and throttling settings. Messages go through the same
+build_dispatcher, TokenBucket and keep-alive session as a campaign; failed
+messages are sent again for up to --retries rounds, as a later run would.
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import numpy as np
+import requests
+
+from dispatcher import BatchDispatcher, Dispatcher, build_session
+from gateway_sim import GatewaySimulator
+from messages import REMINDER
+from notificaciones import WhatsAppAPI, build_dispatcher
+from rate_limiter import DEFAULT_LIMITS, SendResult, TokenBucket
+
+
+def synthetic_messages(count, invalid_rate=0.0, seed=0):
+    """[(key, phone, message)] with Chilean mobiles and reminder texts"""
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(10_000_000, 100_000_000, count)
+    invalid = rng.random(count) < invalid_rate
+    jobs = []
+    for i, (number, bad) in enumerate(zip(numbers, invalid)):
+        phone = f"+569{number}" if not bad else f"+56{number}"
+        message = REMINDER.format(nombre=f"Paciente {i}", fecha="20/10/2026 10:30",
+                                  profesional="Dra. Pérez", motivo="Control")
+        jobs.append((i, phone, message))
+    return jobs
+
+
+def _track_latency(dispatcher, latencies):
+    """Wrap the dispatcher's send function so every call's wall time is appended to `latencies`
+
+    For batch dispatchers each message of a batch gets the latency of its POST.
+    """
+    lock = threading.Lock()
+    if isinstance(dispatcher, BatchDispatcher):
+        send_batch = dispatcher.send_batch_fn
+
+        def timed_batch(items):
+            started = time.perf_counter()
+            outcomes = send_batch(items)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.extend([elapsed] * len(items))
+            return outcomes
+        dispatcher.send_batch_fn = timed_batch
+    else:
+        send = dispatcher.send_fn
+
+        def timed(phone, message):
+            started = time.perf_counter()
+            try:
+                return send(phone, message)
+            finally:
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+        dispatcher.send_fn = timed
+    return dispatcher
+
+
+def _link_sender(base_url, session):
+    """api_link sender that also opens each generated link against the simulator's /send"""
+    base = urlsplit(base_url)
+
+    def send(phone, message):
+        success, result = WhatsAppAPI.send_via_api_link(phone, message)
+        link = urlsplit(result.split(": ", 1)[1])
+        response = session.get(urlunsplit((base.scheme, base.netloc, "/send", link.query, "")), timeout=10)
+        if response.status_code != 200:
+            return False, SendResult(f"Error link: {response.status_code}", status=response.status_code)
+        return success, result
+    return send
+
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.asarray(latencies) * 1000
+    report = {f"p{q}_ms": round(float(np.percentile(values, q)), 2) for q in (50, 90, 99)}
+    report["max_ms"] = round(float(values.max()), 2)
+    return report
+
+
+def drive(url, jobs, method="webhook", concurrency=8, batch_size=0, linger=0.05, rate=None, burst=None,
+          retries=0):
+    """Send `jobs` through the campaign dispatcher, retrying failures; returns the report dict"""
+    default_rate, default_burst = DEFAULT_LIMITS[method]
+    limiter = TokenBucket(rate or default_rate, burst or default_burst)
+    session = build_session(concurrency)
+    rounds = []
+    pending = list(jobs)
+    delivered = 0
+    latencies = []
+    started = time.perf_counter()
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        if method == "api_link":
+            dispatcher = Dispatcher(_link_sender(url, session), max_workers=concurrency, limiter=limiter)
+        else:
+            dispatcher = build_dispatcher("webhook", limiter=limiter, webhook_url=url, session=session,
+                                          concurrency=concurrency, batch_size=batch_size, max_linger=linger)
+        _track_latency(dispatcher, latencies)
+        by_key = {key: (key, phone, message) for key, phone, message in pending}
+        failed, throttled, errors = [], 0, {}
+        round_started = time.perf_counter()
+        for key, success, result in dispatcher.run(pending):
+            if success:
+                delivered += 1
+                continue
+            failed.append(by_key[key])
+            throttled += getattr(result, "status", None) == 429
+            errors[result] = errors.get(result, 0) + 1
+        rounds.append({
+            "intento": attempt + 1,
+            "enviados": len(pending),
+            "fallidos": len(failed),
+            "429": throttled,
+            "segundos": round(time.perf_counter() - round_started, 3),
+            "tasa_final": round(limiter.rate, 2),
+            "errores": dict(sorted(errors.items(), key=lambda e: -e[1])[:5]),
+        })
+        pending = failed
+    seconds = time.perf_counter() - started
+    return {
+        "metodo": method,
+        "mensajes": len(jobs),
+        "entregados": delivered,
+        "sin_entregar": len(pending),
+        "segundos": round(seconds, 3),
+        "entregados_por_s": round(delivered / seconds, 1) if seconds else None,
+        "solicitudes_por_s": round(len(latencies) / seconds, 1) if seconds and not batch_size else None,
+        "latencia": percentiles(latencies),
+        "rondas": rounds,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del envío por webhook o links")
+    parser.add_argument("--url", help="gateway existente; sin esto se levanta gateway_sim en este proceso")
+    parser.add_argument("--method", default="webhook", choices=["webhook", "api_link"])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--invalid-rate", type=float, default=0.0, help="fracción de teléfonos inválidos")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=0)
+    parser.add_argument("--linger", type=float, default=0.05)
+    parser.add_argument("--rate", type=float, help="límite del cliente en mensajes/s (por defecto el del método)")
+    parser.add_argument("--burst", type=int)
+    parser.add_argument("--retries", type=int, default=0, help="rondas de reenvío de los mensajes fallidos")
+    # Parámetros del gateway simulado
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--item-latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--gateway-rate", type=float, help="mensajes/s que admite el gateway antes de responder 429")
+    parser.add_argument("--gateway-burst", type=float)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="guardar el informe como JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = synthetic_messages(args.messages, args.invalid_rate, args.seed)
+    simulator = None
+    url = args.url
+    if url is None:
+        simulator = GatewaySimulator(latency=args.latency, jitter=args.jitter, item_latency=args.item_latency,
+                                     error_rate=args.error_rate, rate=args.gateway_rate,
+                                     burst=args.gateway_burst, seed=args.seed).start()
+        url = simulator.url
+    try:
+        report = drive(url, jobs, args.method, args.concurrency, args.batch_size, args.linger,
+                       args.rate, args.burst, args.retries)
+        if simulator is not None:
+            report["gateway"] = simulator.stats()
+        else:
+            try:
+                report["gateway"] = requests.get(url.rstrip("/") + "/stats", timeout=5).json()
+            except (requests.RequestException, ValueError):
+                report["gateway"] = None
+    finally:
+        if simulator is not None:
+            simulator.stop()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if not report["sin_entregar"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import re
+from string import Formatter
+
+import pandas as pd
+
+REMINDER_TEMPLATE = """🏥 CESFAM Cholchol - Recordatorio de Cita 🏥
+
+Hola {nombre},
+
+Le recordamos que tiene programada una cita médica:
+
+📅 Fecha: {fecha}
+👨‍⚕️ Profesional: {profesional}
+📋 Motivo: {motivo}
+
+📍 Lugar: Centro de Salud Familiar CESFAM Cholchol
+Calle Anibal Pinto 552, Cholchol
+
+📋 Recomendaciones:
+- Llegar 15 minutos antes de su hora de cita
+- Traer su cédula de identidad y carnet de salud
+- Si no puede asistir, notificar con anticipación
+
+Para confirmar, reagendar o consultar:
+📧 Email: cholcholsome@gmail.com
+
+*Este es un mensaje automático, por favor no responder directamente.*"""
+
+CHANGE_TEMPLATE = """🏥 CESFAM Cholchol - Cambio de Cita 🏥
+
+Hola {nombre},
+
+Su cita ha sido reprogramada:
+
+📅 Nueva Fecha: {fecha}
+👨‍⚕️ Profesional: {profesional}
+📋 Motivo: {motivo}
+
+*Mensaje automático*"""
+
+DATE_FORMAT = "%d/%m/%Y"
+
+
+class MessageTemplate:
+    """A message template split once into literals and fields, renderable row by row or column-wise"""
+
+    def __init__(self, template):
+        self.template = template
+        parts = [(literal, field) for literal, field, _, _ in Formatter().parse(template)]
+        self.fields = [field for _, field in parts if field]
+        # Plantilla compilada a formato '%s' posicional para el renderizado por columnas
+        self.compiled = "".join(literal.replace("%", "%%") + ("%s" if field else "")
+                                for literal, field in parts)
+        # Inversa de la plantilla, para guardar sólo los parámetros de un mensaje ya renderizado
+        self.pattern = re.compile("".join(re.escape(literal) + ("(.*?)" if field else "")
+                                          for literal, field in parts) + r"\Z", re.DOTALL)
+
+    def format(self, **fields):
+        return self.template.format(**fields)
+
+    def parse(self, message):
+        """Field values that reproduce `message` exactly, or None if it did not come from this template"""
+        match = self.pattern.match(message)
+        if match is None:
+            return None
+        values = match.groups()
+        if self.compiled % values != message:
+            return None
+        return list(values)
+
+    def render(self, fields):
+        """Render a frame of string columns (one per field) into a Series of messages
+
+        Identical field combinations are rendered once and shared.
+        """
+        compiled = self.compiled
+        rendered = {}
+        messages = [rendered.get(values) or rendered.setdefault(values, compiled % values)
+                    for values in zip(*(fields[f].to_numpy() for f in self.fields))]
+        return pd.Series(messages, index=fields.index, dtype=object)
+
+REMINDER = MessageTemplate(REMINDER_TEMPLATE)
+CHANGE = MessageTemplate(CHANGE_TEMPLATE)
+
+# Identificadores estables usados al compactar mensajes en el log
+TEMPLATES = {"recordatorio": REMINDER, "cambio": CHANGE}
+
+
+def compact_message(message):
+    """(template id, field values) for a message rendered from a known template, else None"""
+    if not isinstance(message, str):
+        return None
+    for template_id, template in TEMPLATES.items():
+        values = template.parse(message)
+        if values is not None:
+            return template_id, values
+    return None
+
+
+def expand_message(template_id, values):
+    return TEMPLATES[template_id].compiled % tuple(values)
+
+
+def format_dates(column, missing="sin fecha"):
+    """strftime each distinct date once; nulls become `missing`"""
+    codes, uniques = pd.factorize(column)
+    labels = pd.Index(uniques).strftime(DATE_FORMAT).to_numpy(dtype=object)
+    formatted = labels.take(codes) if len(labels) else codes.astype(object)
+    formatted[codes == -1] = missing
+    return pd.Series(formatted, index=column.index, dtype=object)
+
+
+def as_text(column):
+    """Same text an f-string would produce for each cell"""
+    return column.astype(object).map(str)
+
+
+def reminder_fields(df):
+    return pd.DataFrame({
+        'nombre': as_text(df['NOMBRE_PACIENTE']),
+        'fecha': format_dates(df['FECHA_ATENCION']),
+        'profesional': as_text(df['PROFESIONAL']),
+        'motivo': as_text(df['MOTIVO_CONSULTA']),
+    }, index=df.index)
+
+
+def change_fields(df):
+    reasignado = df['PROFESIONAL_REASIGNADO'].astype(object)
+    return pd.DataFrame({
+        'nombre': as_text(df['NOMBRE_PACIENTE']),
+        'fecha': format_dates(df['NUEVA_FECHA']),
+        'profesional': as_text(reasignado.where(reasignado.notnull(), "No asignado")),
+        'motivo': as_text(df['MOTIVO_CONSULTA']),
+    }, index=df.index)
+
+
+def render_reminder_messages(df):
+    """Reminder text for every row of `df`, in one vectorized pass"""
+    return REMINDER.render(reminder_fields(df))
+
+
+def render_change_messages(df):
+    """Change-of-appointment text for every row of `df`, in one vectorized pass"""
+    return CHANGE.render(change_fields(df))
+
+
+# Mensajes
+def create_reminder_message(row):
+    fecha_cita = row['FECHA_ATENCION'].strftime(DATE_FORMAT) if pd.notnull(row['FECHA_ATENCION']) else "sin fecha"
+    return REMINDER.format(nombre=row['NOMBRE_PACIENTE'], fecha=fecha_cita,
+                           profesional=row['PROFESIONAL'], motivo=row['MOTIVO_CONSULTA'])
+
+
+def create_change_message(row):
+    nueva_fecha = row['NUEVA_FECHA'].strftime(DATE_FORMAT) if pd.notnull(row['NUEVA_FECHA']) else "sin fecha"
+    profesional = row['PROFESIONAL_REASIGNADO'] if pd.notnull(row['PROFESIONAL_REASIGNADO']) else "No asignado"
+    return CHANGE.format(nombre=row['NOMBRE_PACIENTE'], fecha=nueva_fecha,
+                         profesional=profesional, motivo=row['MOTIVO_CONSULTA'])
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+METRICS_ENV = "NOTIF_METRICS"
+METRICS_FILE = "metrics.prom"
+METRIC_PREFIX = "notificaciones"
+
+# Límites superiores de los buckets, en segundos (el último es +Inf)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DISABLED = nullcontext()
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with count, sum and max"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max for the +Inf bucket)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class Metrics:
+    """Per-stage counters and latency histograms, exported in the Prometheus text format
+
+    Disabled, timed() hands back a shared no-op context manager and observe()
+    and count() return after one attribute check, so instrumented code pays
+    almost nothing. Enable it with NOTIF_METRICS=1, the CLI flag or the
+    sidebar panel.
+    """
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self.started_at = time.time()
+
+    # Registro
+    def observe(self, stage, seconds, **labels):
+        """Record one duration for `stage` (labels such as method=... split the series)"""
+        if not self.enabled:
+            return
+        key = (stage, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def timed(self, stage, **labels):
+        """Context manager timing its block into the `stage` histogram"""
+        if not self.enabled:
+            return _DISABLED
+        return self._timed(stage, labels)
+
+    @contextmanager
+    def _timed(self, stage, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.started_at = time.time()
+
+    # Exportación
+    def snapshot(self):
+        """One row per stage series: stage, labels, count, total and mean/p50/p95/max in ms"""
+        with self._lock:
+            items = sorted(self._histograms.items())
+            rows = []
+            for (stage, labels), h in items:
+                rows.append({
+                    "etapa": stage,
+                    "etiquetas": ", ".join(f"{k}={v}" for k, v in labels),
+                    "n": h.count,
+                    "total_s": round(h.sum, 3),
+                    "media_ms": round(1000 * h.sum / h.count, 2) if h.count else 0.0,
+                    "p50_ms": round(1000 * h.quantile(0.5), 2),
+                    "p95_ms": round(1000 * h.quantile(0.95), 2),
+                    "max_ms": round(1000 * h.max, 2),
+                })
+        return rows
+
+    def counters(self):
+        with self._lock:
+            return {(name, ", ".join(f"{k}={v}" for k, v in labels)): value
+                    for (name, labels), value in sorted(self._counters.items())}
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        stage_metric = f"{METRIC_PREFIX}_stage_seconds"
+        lines = [f"# HELP {stage_metric} Duración de cada etapa de la campaña.",
+                 f"# TYPE {stage_metric} histogram"]
+        with self._lock:
+            for (stage, labels), h in sorted(self._histograms.items()):
+                base = (("stage", stage),) + labels
+                cumulative = 0
+                for bound, n in zip(self.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f"{stage_metric}_bucket{_format_labels(base + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{stage_metric}_bucket{_format_labels(base + (('le', '+Inf'),))} {h.count}")
+                lines.append(f"{stage_metric}_sum{_format_labels(base)} {h.sum!r}")
+                lines.append(f"{stage_metric}_count{_format_labels(base)} {h.count}")
+            names = sorted({name for name, _ in self._counters})
+            for name in names:
+                metric = f"{METRIC_PREFIX}_{name}_total"
+                lines.append(f"# TYPE {metric} counter")
+                for (counter, labels), value in sorted(self._counters.items()):
+                    if counter == name:
+                        lines.append(f"{metric}{_format_labels(labels)} {value}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_start_time_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}_start_time_seconds {self.started_at!r}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path=METRICS_FILE):
+        """Write render() atomically, for node_exporter's textfile collector or a scraper sidecar"""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+        return path
+
+
+METRICS = Metrics(enabled=os.environ.get(METRICS_ENV, "") not in ("", "0"))
+
+
+def timed_send(send_fn, method):
+    """Wrap a (phone, message) sender so each call is timed and counted per method and outcome"""
+    def send(phone, message):
+        if not METRICS.enabled:
+            return send_fn(phone, message)
+        started = time.perf_counter()
+        success, result = send_fn(phone, message)
+        METRICS.observe("send", time.perf_counter() - started, method=method)
+        METRICS.count("sends", method=method, status="ok" if success else "error")
+        return success, result
+    return send
+
+
+def timed_batch_send(send_batch_fn, method):
+    """Same as timed_send for a batch sender; the histogram holds one sample per POST"""
+    def send_batch(items):
+        if not METRICS.enabled:
+            return send_batch_fn(items)
+        started = time.perf_counter()
+        outcomes = send_batch_fn(items)
+        METRICS.observe("send_batch", time.perf_counter() - started, method=method)
+        ok = sum(1 for success, _ in outcomes if success)
+        METRICS.count("sends", ok, method=method, status="ok")
+        METRICS.count("sends", len(outcomes) - ok, method=method, status="error")
+        return outcomes
+    return send_batch
@@ -0,0 +1,725 @@
+import importlib.util
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import quote
+
+from agenda import (DateIndex, NOTIFICATION_WINDOW_DAYS, SCHEMA_VERSION, add_phone_columns, compact_dtypes,
+                    read_agenda, select_changes, select_reminders, window_bounds)
+from dispatcher import BatchDispatcher, Dispatcher
+from idempotency import idempotency_key
+from messages import render_change_messages, render_reminder_messages
+from metrics import METRICS, timed_batch_send, timed_send
+from rate_limiter import SendResult, is_read_timeout, is_timeout
+from result_buffer import ResultBuffer
+
+# Detect environment and available messaging methods
+def detect_environment():
+    """Detect the current environment and available messaging capabilities"""
+    env_info = {
+        'is_cloud': any([
+            'STREAMLIT_SERVER_PORT' in os.environ,
+            'STREAMLIT_BROWSER_GATHER_USAGE_STATS' in os.environ,
+            os.environ.get('DISPLAY') == '',
+            'DISPLAY' not in os.environ
+        ]),
+        'selenium_available': False,
+        'api_available': False
+    }
+    
+    # Check for Selenium: find_spec no lo importa; se carga recién al abrir el navegador
+    if not env_info['is_cloud']:
+        try:
+            env_info['selenium_available'] = importlib.util.find_spec("selenium") is not None
+        except (ImportError, ValueError):
+            pass
+    
+    # API methods are always available
+    env_info['api_available'] = True
+    
+    return env_info
+
+# Initialize environment
+ENV_INFO = detect_environment()
+
+PROFILES_DIR = "whatsapp_profiles"
+
+COMPOSER_SELECTOR = '[data-testid="message-composer"] [contenteditable="true"]'
+OUTGOING_SELECTOR = 'div.message-out'
+SENT_ICONS = ('msg-check', 'msg-dblcheck', 'msg-dblcheck-ack')
+# Envíos cuyas etapas se conservan para latency_stats
+TIMINGS_KEPT = 1000
+
+# Abre un chat dentro de la app ya cargada, sin recargar la página
+OPEN_CHAT_JS = """
+const link = document.createElement('a');
+link.href = 'https://web.whatsapp.com/send?phone=' + arguments[0];
+link.style.display = 'none';
+document.body.appendChild(link);
+link.click();
+link.remove();
+"""
+
+# Inserta el mensaje completo (multilínea, emojis) en una sola operación de pegado
+PASTE_TEXT_JS = """
+const box = arguments[0];
+box.focus();
+const data = new DataTransfer();
+data.setData('text/plain', arguments[1]);
+box.dispatchEvent(new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true}));
+return box.innerText.trim().length;
+"""
+
+# Ícono de estado del último mensaje saliente ('msg-time' mientras está pendiente)
+LAST_STATUS_JS = """
+const out = document.querySelectorAll(arguments[0]);
+if (out.length <= arguments[1]) return null;
+const icon = out[out.length - 1].querySelector('span[data-icon^="msg-"]');
+return icon ? icon.getAttribute('data-icon') : null;
+"""
+
+# WhatsApp Selenium Class
+class WhatsAppSelenium:
+    def __init__(self, profile_dir=None, fast_path=True):
+        self.driver = None
+        self.is_logged_in = False
+        self.profile_dir = profile_dir
+        self.fast_path = fast_path
+        self.started_at = None
+        self.sent_count = 0
+        self.app_loaded = False
+        self.timings = deque(maxlen=TIMINGS_KEPT)
+        # Un navegador atiende un envío a la vez, aunque lo compartan varios pools
+        self.lock = threading.Lock()
+    
+    def setup_driver(self):
+        """Setup Chrome driver for WhatsApp Web"""
+        if ENV_INFO['is_cloud']:
+            return False, "Selenium no disponible en entorno cloud"
+        
+        try:
+            from selenium import webdriver
+            from selenium.webdriver.chrome.options import Options
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+            
+            options = Options()
+            options.add_argument('--no-sandbox')
+            options.add_argument('--disable-dev-shm-usage')
+            options.add_argument('--disable-gpu')
+            options.add_argument('--window-size=1920,1080')
+            
+            # Perfil persistente: la sesión de WhatsApp Web sobrevive a reinicios
+            if self.profile_dir:
+                os.makedirs(self.profile_dir, exist_ok=True)
+                options.add_argument(f'--user-data-dir={os.path.abspath(self.profile_dir)}')
+            
+            # Optional: run in headless mode (uncomment next line)
+            # options.add_argument('--headless')
+            
+            self.driver = webdriver.Chrome(options=options)
+            self.started_at = time.monotonic()
+            self.sent_count = 0
+            self.app_loaded = False
+            return True, "Driver configurado exitosamente"
+        except Exception as e:
+            return False, f"Error configurando driver: {str(e)}"
+    
+    def login_whatsapp(self):
+        """Navigate to WhatsApp Web and wait for QR scan"""
+        if not self.driver:
+            return False, "Driver no inicializado"
+        
+        try:
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+            
+            self.driver.get("https://web.whatsapp.com")
+            
+            # Wait for QR code or main interface
+            wait = WebDriverWait(self.driver, 60)
+            
+            # Check if already logged in or need to scan QR
+            try:
+                # Wait for either QR code or chat list
+                wait.until(
+                    lambda driver: driver.find_elements(By.CSS_SELECTOR, '[data-testid="qr-code"]') or 
+                                 driver.find_elements(By.CSS_SELECTOR, '[data-testid="chat-list"]')
+                )
+                
+                # Check if we're in the main interface
+                if self.driver.find_elements(By.CSS_SELECTOR, '[data-testid="chat-list"]'):
+                    self.is_logged_in = True
+                    self.app_loaded = True
+                    return True, "Ya conectado a WhatsApp Web"
+                else:
+                    return False, "Necesita escanear código QR en WhatsApp Web"
+                    
+            except Exception as e:
+                return False, f"Error esperando login: {str(e)}"
+                
+        except Exception as e:
+            return False, f"Error accediendo a WhatsApp Web: {str(e)}"
+    
+    def send_message(self, phone, message):
+        """Send message via WhatsApp Web"""
+        if not self.driver or not self.is_logged_in:
+            return False, "WhatsApp Web no está conectado"
+        
+        # Format phone number
+        if not phone.startswith("+"):
+            phone = "+56" + str(phone)
+        
+        started = time.perf_counter()
+        if self.fast_path:
+            success, result, stages = self._send_fast(phone.replace('+', ''), message)
+        else:
+            success, result, stages = self._send_legacy(phone.replace('+', ''), message)
+        stages['total'] = time.perf_counter() - started
+        stages['fast_path'] = self.fast_path
+        stages['success'] = success
+        self.timings.append(stages)
+        if success:
+            self.sent_count += 1
+        return success, result
+    
+    def _send_legacy(self, phone_digits, message):
+        """Full page load, key-by-key typing and a fixed 2 s wait"""
+        stages = {}
+        try:
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+            
+            # Navigate to chat
+            mark = time.perf_counter()
+            url = f"https://web.whatsapp.com/send?phone={phone_digits}"
+            self.driver.get(url)
+            
+            wait = WebDriverWait(self.driver, 30)
+            
+            # Wait for message input box
+            message_box = wait.until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, COMPOSER_SELECTOR))
+            )
+            stages['open'] = time.perf_counter() - mark
+            
+            # Clear and send message
+            mark = time.perf_counter()
+            message_box.clear()
+            message_box.send_keys(message)
+            stages['insert'] = time.perf_counter() - mark
+            
+            # Find and click send button
+            mark = time.perf_counter()
+            send_button = wait.until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, '[data-testid="send"]'))
+            )
+            send_button.click()
+            
+            time.sleep(2)  # Wait for message to send
+            stages['confirm'] = time.perf_counter() - mark
+            return True, "Mensaje enviado via Selenium", stages
+            
+        except Exception as e:
+            return False, SendResult(f"Error enviando mensaje: {str(e)}", backpressure=is_timeout(e)), stages
+    
+    def _open_chat(self, phone_digits):
+        """Open the chat in the loaded app when possible, else with a full page load"""
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+        from selenium.webdriver.support import expected_conditions as EC
+        
+        if self.app_loaded:
+            previous = self.driver.find_elements(By.CSS_SELECTOR, COMPOSER_SELECTOR)
+            try:
+                self.driver.execute_script(OPEN_CHAT_JS, phone_digits)
+                if previous:
+                    WebDriverWait(self.driver, 5).until(EC.staleness_of(previous[0]))
+                return WebDriverWait(self.driver, 10).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, COMPOSER_SELECTOR))
+                )
+            except Exception:
+                pass  # Se recurre a la carga completa
+        
+        self.driver.get(f"https://web.whatsapp.com/send?phone={phone_digits}")
+        self.app_loaded = True
+        return WebDriverWait(self.driver, 30).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, COMPOSER_SELECTOR))
+        )
+    
+    def _insert_text(self, message_box, message):
+        """Paste the whole message at once; fall back to typing with Shift+Enter line breaks"""
+        from selenium.webdriver.common.action_chains import ActionChains
+        from selenium.webdriver.common.keys import Keys
+        
+        if self.driver.execute_script(PASTE_TEXT_JS, message_box, message):
+            return
+        message_box.click()
+        actions = ActionChains(self.driver)
+        for i, line in enumerate(message.split("\n")):
+            if i:
+                actions.key_down(Keys.SHIFT).send_keys(Keys.ENTER).key_up(Keys.SHIFT)
+            actions.send_keys(line)
+        actions.perform()
+    
+    def _send_fast(self, phone_digits, message, confirm_timeout=15):
+        """In-app chat switch, single-operation insert and wait for the sent tick"""
+        stages = {}
+        try:
+            from selenium.webdriver.common.by import By
+            from selenium.webdriver.support.ui import WebDriverWait
+            from selenium.webdriver.support import expected_conditions as EC
+            from selenium.common.exceptions import TimeoutException
+            
+            mark = time.perf_counter()
+            message_box = self._open_chat(phone_digits)
+            stages['open'] = time.perf_counter() - mark
+            
+            mark = time.perf_counter()
+            self._insert_text(message_box, message)
+            stages['insert'] = time.perf_counter() - mark
+            
+            mark = time.perf_counter()
+            outgoing_before = len(self.driver.find_elements(By.CSS_SELECTOR, OUTGOING_SELECTOR))
+            WebDriverWait(self.driver, 10).until(
+                EC.element_to_be_clickable((By.CSS_SELECTOR, '[data-testid="send"]'))
+            ).click()
+            try:
+                WebDriverWait(self.driver, confirm_timeout, poll_frequency=0.1).until(
+                    lambda driver: driver.execute_script(LAST_STATUS_JS, OUTGOING_SELECTOR, outgoing_before) in SENT_ICONS
+                )
+            except TimeoutException:
+                stages['confirm'] = time.perf_counter() - mark
+                # El clic ya ocurrió: el mensaje pudo salir, así que no se reintenta automáticamente
+                return False, SendResult(f"Sin confirmación de envío tras {confirm_timeout} s",
+                                         backpressure=True, unconfirmed=True), stages
+            stages['confirm'] = time.perf_counter() - mark
+            return True, "Mensaje enviado via Selenium", stages
+            
+        except Exception as e:
+            return False, SendResult(f"Error enviando mensaje: {str(e)}", backpressure=is_timeout(e)), stages
+    
+    def latency_stats(self):
+        """Mean per-stage latency (seconds) of the last TIMINGS_KEPT sends, split by path"""
+        stats = {}
+        for path in (True, False):
+            rows = [t for t in self.timings if t['fast_path'] is path and t['success']]
+            if rows:
+                stats['rapido' if path else 'clasico'] = {
+                    stage: sum(r.get(stage, 0.0) for r in rows) / len(rows)
+                    for stage in ('open', 'insert', 'confirm', 'total')
+                } | {'mensajes': len(rows)}
+        return stats
+    
+    def is_healthy(self):
+        """Check that the browser still answers and WhatsApp Web is loaded"""
+        if not self.driver:
+            return False
+        try:
+            return "web.whatsapp.com" in self.driver.execute_script("return window.location.href")
+        except Exception:
+            return False
+    
+    def is_stale(self, max_age, max_sends):
+        """A driver is recycled after `max_age` seconds or `max_sends` messages"""
+        if not self.driver or self.started_at is None:
+            return False
+        return time.monotonic() - self.started_at > max_age or self.sent_count >= max_sends
+    
+    def close(self):
+        """Close the browser"""
+        if self.driver:
+            try:
+                self.driver.quit()
+            except Exception:
+                pass
+            self.driver = None
+            self.is_logged_in = False
+
+def profile_path(sender, profiles_dir=PROFILES_DIR):
+    return os.path.join(profiles_dir, re.sub(r'[^0-9A-Za-z+_-]', '_', sender))
+
+class SeleniumPool:
+    """Logged-in WhatsApp Web drivers, one per sender number, leased to send workers
+
+    A Chrome profile can only be open in one browser, so pools that may coexist
+    (one per Streamlit session) pass the same `clients` registry: each profile
+    then has a single WhatsAppSelenium, whose lock serializes the pools' sends.
+    """
+    
+    def __init__(self, senders, profiles_dir=PROFILES_DIR, max_age=3600, max_sends=500, clients=None):
+        self.senders = list(senders)
+        self.fast_path = True
+        self.max_age = max_age
+        self.max_sends = max_sends
+        registry = {} if clients is None else clients
+        self.clients = {}
+        for sender in self.senders:
+            path = profile_path(sender, profiles_dir)
+            self.clients[sender] = registry.setdefault(path, WhatsAppSelenium(path))
+        self._idle = queue.Queue()
+        for sender in self.senders:
+            self._idle.put(sender)
+    
+    @property
+    def size(self):
+        return len(self.senders)
+    
+    @contextmanager
+    def lease(self):
+        """Borrow an idle sender until the block ends"""
+        sender = self._idle.get()
+        client = self.clients[sender]
+        try:
+            with client.lock:
+                yield sender, client
+        finally:
+            self._idle.put(sender)
+    
+    def _ensure_ready(self, client):
+        """Start, or recycle and restart, a driver that is missing, stale or unhealthy"""
+        if client.driver and (client.is_stale(self.max_age, self.max_sends) or not client.is_healthy()):
+            client.close()
+        if not client.driver:
+            success, msg = client.setup_driver()
+            if not success:
+                return False, msg
+        if not client.is_logged_in:
+            return client.login_whatsapp()
+        return True, "Sesión activa"
+    
+    def send(self, phone, message):
+        with self.lease() as (sender, client):
+            client.fast_path = self.fast_path
+            success, msg = self._ensure_ready(client)
+            if not success:
+                return False, f"[{sender}] {msg}"
+            success, result = client.send_message(phone, message)
+            if not success and not client.is_healthy():
+                client.close()
+            return success, result
+    
+    def status(self):
+        return [{'remitente': sender,
+                 'activo': client.driver is not None,
+                 'conectado': client.is_logged_in,
+                 'enviados': client.sent_count,
+                 'latencia_s': round(client.timings[-1]['total'], 2) if client.timings else None}
+                for sender, client in self.clients.items()]
+    
+    def close_all(self):
+        for client in self.clients.values():
+            with client.lock:
+                client.close()
+
+# WhatsApp API alternatives (for cloud environments)
+def _requests():
+    # requests se importa al primer envío, no al arrancar la app
+    import requests
+    return requests
+
+class WhatsAppAPI:
+    @staticmethod
+    def send_via_api_link(phone, message):
+        """Generate WhatsApp API link for manual sending"""
+        if not phone.startswith("+"):
+            phone = "+56" + str(phone)
+        
+        encoded_message = quote(message)
+        phone_clean = phone.replace("+", "")
+        
+        whatsapp_url = f"https://api.whatsapp.com/send?phone={phone_clean}&text={encoded_message}"
+        
+        return True, f"Link generado: {whatsapp_url}"
+    
+    @staticmethod
+    def send_via_webhook(phone, message, webhook_url=None, session=None):
+        """Send via external webhook service (placeholder for custom implementation)"""
+        if not webhook_url:
+            return False, "Webhook URL no configurada"
+        
+        try:
+            payload = {
+                "phone": phone,
+                "message": message,
+                "timestamp": datetime.now().isoformat()
+            }
+            
+            http = session or _requests()
+            response = http.post(webhook_url, json=payload, timeout=10)
+            if response.status_code == 200:
+                return True, "Mensaje enviado via webhook"
+            else:
+                return False, SendResult(f"Error webhook: {response.status_code}", status=response.status_code)
+        except Exception as e:
+            # Tras un timeout de lectura el gateway pudo haber aceptado el mensaje: queda sin confirmar
+            return False, SendResult(f"Error webhook: {str(e)}", backpressure=is_timeout(e),
+                                     unconfirmed=is_read_timeout(e))
+    
+    @staticmethod
+    def send_batch_via_webhook(items, webhook_url=None, session=None):
+        """Send a list of (phone, message) as one JSON array; returns one (success, result) per item
+
+        The gateway may answer with a list (or {"results": [...]}) of per-item
+        objects carrying "success"/"ok" and "error", optionally with an "index"
+        into the request; any other 200 response accepts the whole batch.
+        """
+        if not webhook_url:
+            return [(False, "Webhook URL no configurada")] * len(items)
+        
+        timestamp = datetime.now().isoformat()
+        payload = [{"phone": phone, "message": message, "timestamp": timestamp}
+                   for phone, message in items]
+        try:
+            http = session or _requests()
+            response = http.post(webhook_url, json=payload, timeout=30)
+        except Exception as e:
+            return [(False, SendResult(f"Error webhook: {str(e)}", backpressure=is_timeout(e),
+                                       unconfirmed=is_read_timeout(e)))] * len(items)
+        
+        if response.status_code != 200:
+            return [(False, SendResult(f"Error webhook: {response.status_code}",
+                                       status=response.status_code))] * len(items)
+        
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if isinstance(body, dict):
+            body = body.get("results")
+        if not isinstance(body, list):
+            return [(True, "Mensaje enviado via webhook (lote)")] * len(items)
+        
+        outcomes = [(False, "Sin respuesta del webhook para este mensaje")] * len(items)
+        for position, item in enumerate(body):
+            if not isinstance(item, dict):
+                continue
+            index = item.get("index", position)
+            if not isinstance(index, int) or not 0 <= index < len(items):
+                continue
+            ok = item.get("success", item.get("ok", False))
+            if ok:
+                outcomes[index] = (True, "Mensaje enviado via webhook (lote)")
+            else:
+                outcomes[index] = (False, f"Error webhook: {item.get('error', 'rechazado')}")
+        return outcomes
+
+# Función cargar datos
+def load_data(file, cache=None, digest=None):
+    """Return (df, date_index) for an agenda file or upload
+
+    Phones are normalized to E.164 with a validity mask and columns are given
+    compact dtypes (see agenda.compact_dtypes) once per file: with an
+    UploadCache the parsed and normalized frame is looked up (and stored) by the
+    content digest of the file.
+    """
+    started = time.perf_counter()
+    df = None
+    # La versión del esquema invalida frames guardados con columnas o tipos anteriores
+    cache_key = f"{digest}.v{SCHEMA_VERSION}" if digest else None
+    if cache is not None and cache_key:
+        df = cache.get(cache_key)
+    cached = df is not None
+    if df is None:
+        df = compact_dtypes(add_phone_columns(read_agenda(file)))
+        if cache is not None and cache_key:
+            cache.put(cache_key, df)
+    date_index = DateIndex(df['FECHA_ATENCION'])
+    METRICS.observe("load_data", time.perf_counter() - started, cache="hit" if cached else "miss")
+    return df, date_index
+
+# Guardar logs
+def save_log(log_entry, log, store=None):
+    """Append an attempt to the log and, when given, to the SQLite store"""
+    with METRICS.timed("save_log"):
+        log.append(log_entry)
+        if store is not None:
+            store.record_attempt(log_entry)
+            if log_entry.get("status") == "Enviado":
+                store.mark_notified(log_entry.get("rut"), log_entry.get("fecha_atencion"),
+                                    log_entry.get("type"), log_entry.get("method"),
+                                    log_entry.get("timestamp"))
+
+def resolve_method(method):
+    """Concrete method used by send_whatsapp_message for `method`"""
+    if method == "selenium" and ENV_INFO['selenium_available']:
+        return "selenium"
+    if method in ("api_link", "webhook"):
+        return method
+    if ENV_INFO['selenium_available'] and not ENV_INFO['is_cloud']:
+        return "selenium"
+    return "api_link"
+
+# Main sending function with multiple methods
+def send_whatsapp_message(phone, message, method="auto", pool=None, webhook_url=None, session=None):
+    """Send WhatsApp message using available method"""
+    
+    if method == "selenium" and ENV_INFO['selenium_available']:
+        if pool is None:
+            return False, "Pool de Selenium no inicializado"
+        return pool.send(phone, message)
+    
+    elif method == "api_link":
+        return WhatsAppAPI.send_via_api_link(phone, message)
+    
+    elif method == "webhook":
+        return WhatsAppAPI.send_via_webhook(phone, message, webhook_url, session)
+    
+    else:
+        # Auto mode - use best available method
+        return send_whatsapp_message(phone, message, resolve_method(method), pool, webhook_url, session)
+
+def build_dispatcher(method, limiter=None, pool=None, webhook_url=None, session=None,
+                     concurrency=1, batch_size=0, max_linger=0.5):
+    """Build the dispatcher for a send method
+
+    Webhook and Selenium sends run on worker threads (Selenium with one
+    worker per pooled sender); API links stay serial. Every send is timed per
+    method in metrics.METRICS when it is enabled.
+    """
+    resolved = resolve_method(method)
+    if resolved == "selenium" and pool is not None:
+        return Dispatcher(timed_send(pool.send, resolved), max_workers=pool.size, limiter=limiter)
+    if method == "webhook":
+        if batch_size:
+            def send_batch(items):
+                return WhatsAppAPI.send_batch_via_webhook(items, webhook_url, session)
+            return BatchDispatcher(timed_batch_send(send_batch, method), batch_size, max_linger,
+                                   max_workers=concurrency, limiter=limiter)
+        def send(phone, message):
+            return WhatsAppAPI.send_via_webhook(phone, message, webhook_url, session)
+        return Dispatcher(timed_send(send, method), max_workers=concurrency, limiter=limiter)
+    def send(phone, message):
+        return send_whatsapp_message(phone, message, method, pool, webhook_url, session)
+    return Dispatcher(timed_send(send, resolved), limiter=limiter)
+
+# Campaña
+def collect_jobs(df, date_index, today=None, window_days=NOTIFICATION_WINDOW_DAYS, checkpoint=None):
+    """Select the window and render every message: {(idx, tipo): (row, message)}
+
+    Rows with an invalid phone never become jobs. Sends already journaled in `checkpoint` are left out, so a resumed run
+    only dispatches what is still pending.
+    """
+    today, target_date = window_bounds(today or datetime.now().date(), window_days)
+    
+    with METRICS.timed("filter"):
+        # 1️⃣ Recordatorios de citas nuevas (no notificadas)
+        to_notify = select_reminders(df, date_index, today, target_date)
+        
+        # 2️⃣ Mensajes de reprogramación
+        changed_appointments = select_changes(df, date_index, today, target_date)
+    
+    # Mensajes renderizados por columnas, una sola pasada por tipo
+    with METRICS.timed("render"):
+        reminder_messages = render_reminder_messages(to_notify)
+        change_messages = render_change_messages(changed_appointments)
+    
+    jobs = {}
+    for tipo, rows, messages in (("Recordatorio", to_notify, reminder_messages),
+                                 ("Cambio de Cita", changed_appointments, change_messages)):
+        for idx, row in rows.iterrows():
+            if checkpoint is not None and checkpoint.is_done(row['RUT'], row['FECHA_ATENCION'], tipo):
+                continue
+            jobs[(idx, tipo)] = (row, messages[idx])
+    return jobs
+
+def job_key(row, tipo, message):
+    return idempotency_key(row['RUT'], row['TELEFONO_E164'], row['FECHA_ATENCION'], tipo, message)
+
+def claim_jobs(jobs, index):
+    """Keep only the jobs `index` has not seen (and reserve them); returns (jobs, duplicates)
+
+    Jobs that repeat a key already in `jobs` (the same row twice in one upload)
+    are duplicates too: only the first of them is sent.
+    """
+    keys = {job: job_key(row, job[1], message) for job, (row, message) in jobs.items()}
+    claimed = index.claim(list(keys.values()))
+    fresh = {}
+    for job, payload in jobs.items():
+        if keys[job] in claimed:
+            claimed.discard(keys[job])
+            fresh[job] = payload
+    return fresh, len(jobs) - len(fresh)
+
+def send_status(success, result):
+    """Log status of a send: Enviado, Sin confirmar (it may have gone out) or Error"""
+    if success:
+        return "Enviado"
+    return "Sin confirmar" if getattr(result, "unconfirmed", False) else "Error"
+
+def make_log_entry(row, tipo, method, message, success, result, timestamp=None):
+    return {
+        "timestamp": (timestamp or datetime.now()).isoformat(),
+        "patient": row['NOMBRE_PACIENTE'],
+        "rut": row['RUT'],
+        "phone": row['TELEFONO_E164'],
+        "fecha_atencion": row['FECHA_ATENCION'],
+        "type": tipo,
+        "method": method,
+        "message": message,
+        "status": send_status(success, result),
+        "result": result
+    }
+
+def iter_results(df, jobs, dispatcher, method, checkpoint=None, idempotency=None, log_fn=None):
+    """Dispatch `jobs`, buffer each outcome for `df` and yield it with its log entry
+
+    Yields (idx, tipo, row, message, success, result, log_entry) on the caller's
+    thread, in completion order. Successful sends are journaled in `checkpoint`
+    and confirmed in the `idempotency` index before they are yielded; failed
+    ones release their claim so a later run can retry them, except unconfirmed
+    ones, which keep it until the lease expires so they are not sent twice. Outcomes reach
+    `df` in column-wise batches (see ResultBuffer), flushed when the run ends
+    or the generator is closed. Closing it early cancels the queued sends:
+    those that were already in flight are journaled and confirmed like the
+    yielded ones, and the claims of jobs that never went out are released.
+    Their log entries are never yielded, so they go to `log_fn(log_entry)`
+    (pass the same function that saves the yielded entries).
+    """
+    buffer = ResultBuffer(df)
+    settled = set()
+
+    def settle(job, success, result):
+        settled.add(job)
+        row, message = jobs[job]
+        timestamp = datetime.now()
+        key = job_key(row, job[1], message)
+        if idempotency is not None:
+            if success:
+                idempotency.confirm(key)
+            elif not getattr(result, "unconfirmed", False):
+                idempotency.release(key)
+        if success and checkpoint is not None:
+            checkpoint.record(row['RUT'], row['FECHA_ATENCION'], job[1], method, timestamp.isoformat())
+        buffer.add(job[0], job[1], success, timestamp, method, key.hex())
+        return row, message, timestamp
+
+    def drain(job, success, result):
+        row, message, timestamp = settle(job, success, result)
+        if log_fn is not None:
+            log_fn(make_log_entry(row, job[1], method, message, success, result, timestamp))
+
+    results = dispatcher.run(((key, row['TELEFONO_E164'], message) for key, (row, message) in jobs.items()),
+                             drain=drain)
+    try:
+        for (idx, tipo), success, result in results:
+            row, message, timestamp = settle((idx, tipo), success, result)
+            yield idx, tipo, row, message, success, result, make_log_entry(row, tipo, method, message, success,
+                                                                             result, timestamp)
+    finally:
+        # Cancela lo que sigue en cola y registra lo que ya estaba enviándose
+        results.close()
+        if idempotency is not None and len(settled) < len(jobs):
+            idempotency.release_many(job_key(row, job[1], message) for job, (row, message) in jobs.items()
+                                     if job not in settled)
+        if checkpoint is not None:
+            checkpoint.flush()
+        buffer.flush()
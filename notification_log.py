@@ -0,0 +1,278 @@
+import gzip
+import io
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from messages import compact_message, expand_message
+
+LEGACY_LOG_FILE = "notification_log.json"
+LOG_DIR = "notification_logs"
+SEGMENT_PREFIX = "notification_log_"
+SEGMENT_SUFFIX = ".jsonl"
+
+# zstd si está instalado; si no, gzip de la biblioteca estándar
+try:
+    import zstandard
+    ARCHIVE_SUFFIX = ".jsonl.zst"
+except ImportError:
+    zstandard = None
+    ARCHIVE_SUFFIX = ".jsonl.gz"
+ARCHIVE_SUFFIXES = (".jsonl.gz", ".jsonl.zst")
+
+
+def _segment_key(path):
+    """'YYYYMMDD_NNN' of a live or archived segment"""
+    name = os.path.basename(path)
+    return name[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 12]
+
+
+def _open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"Se necesita el paquete zstandard para leer {path}")
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True),
+                                encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+def compact_entry(entry):
+    """Replace a templated message body with its template id and field values"""
+    compacted = compact_message(entry.get("message"))
+    if compacted is None:
+        return entry
+    entry = dict(entry)
+    del entry["message"]
+    entry["template"], entry["params"] = compacted
+    return entry
+
+
+def expand_entry(entry):
+    if "template" in entry:
+        entry["message"] = expand_message(entry.pop("template"), entry.pop("params"))
+    return entry
+
+
+class NotificationLog:
+    """Append-only JSON Lines log split into daily, size-bounded segments
+
+    Message bodies rendered from a known template are stored as template id plus
+    field values. Closed segments are compressed into archives after
+    `archive_after_days` and, when `retention_days` is set, deleted once they
+    are older than that; archives stay readable through read(). `on_expire`
+    receives the retention cutoff (a datetime) after each rotation, so copies
+    of the log kept elsewhere, such as NotificationStore.prune_attempts, follow
+    the same policy.
+    """
+
+    def __init__(self, log_dir=LOG_DIR, max_segment_bytes=5 * 1024 * 1024,
+                 fsync_every=50, fsync_interval=2.0, archive_after_days=1, retention_days=None, on_expire=None):
+        self.log_dir = log_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self.on_expire = on_expire
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment_path = None
+        self._segment_day = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.rotate()
+
+    # Segmentos
+    def segments(self):
+        """Return live and archived segment paths sorted from oldest to newest"""
+        names = [n for n in os.listdir(self.log_dir)
+                 if n.startswith(SEGMENT_PREFIX) and n.endswith((SEGMENT_SUFFIX,) + ARCHIVE_SUFFIXES)]
+        return [os.path.join(self.log_dir, n) for n in sorted(names, key=_segment_key)]
+
+    def _segment_name(self, day, seq):
+        return os.path.join(self.log_dir, f"{SEGMENT_PREFIX}{day}_{seq:03d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, day):
+        """Open the newest segment for `day`, rolling over when it is full or archived"""
+        self._close_file()
+        day_segments = [p for p in self.segments() if _segment_key(p).startswith(f"{day}_")]
+        seq = 0
+        if day_segments:
+            last = day_segments[-1]
+            seq = int(_segment_key(last)[9:])
+            if not last.endswith(SEGMENT_SUFFIX) or os.path.getsize(last) >= self.max_segment_bytes:
+                seq += 1
+        self._segment_path = self._segment_name(day, seq)
+        self._segment_day = day
+        self._file = open(self._segment_path, "a", encoding="utf-8")
+
+    # Rotación
+    def _archive(self, path):
+        """Compress a closed segment next to itself and remove the original"""
+        archive_path = path[:-len(SEGMENT_SUFFIX)] + ARCHIVE_SUFFIX
+        tmp_path = archive_path + ".tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as raw:
+            if zstandard is not None:
+                with zstandard.ZstdCompressor(level=10).stream_writer(raw, closefd=False) as dst:
+                    dst.write(src.read())
+            else:
+                with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=9) as dst:
+                    dst.write(src.read())
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, archive_path)
+        os.remove(path)
+        return archive_path
+
+    def rotate(self, today=None):
+        """Archive closed segments older than `archive_after_days`; drop those past `retention_days`
+
+        Returns (archived, deleted) counts.
+        """
+        today = today or datetime.now()
+        archive_before = (today - timedelta(days=self.archive_after_days)).strftime("%Y%m%d")
+        cutoff = ((today - timedelta(days=self.retention_days)).replace(hour=0, minute=0, second=0, microsecond=0)
+                  if self.retention_days else None)
+        delete_before = cutoff.strftime("%Y%m%d") if cutoff else None
+        archived = deleted = 0
+        with self._lock:
+            for path in self.segments():
+                day = _segment_key(path)[:8]
+                if path == self._segment_path:
+                    continue
+                if delete_before and day < delete_before:
+                    os.remove(path)
+                    deleted += 1
+                elif path.endswith(SEGMENT_SUFFIX) and day <= archive_before:
+                    self._archive(path)
+                    archived += 1
+        if cutoff and self.on_expire is not None:
+            self.on_expire(cutoff)
+        return archived, deleted
+
+    def _close_file(self):
+        if self._file:
+            self._sync()
+            self._file.close()
+            self._file = None
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    # Escritura
+    def append(self, entry):
+        """Append one entry; fsync is batched every `fsync_every` entries or `fsync_interval` seconds"""
+        line = json.dumps(compact_entry(entry), default=str, ensure_ascii=False) + "\n"
+        day = datetime.now().strftime("%Y%m%d")
+        if self._segment_day is not None and day != self._segment_day:
+            # Cambio de día: el segmento de ayer queda cerrado y puede archivarse
+            self.close()
+            self.rotate()
+        with self._lock:
+            if self._file is None or day != self._segment_day:
+                self._open_segment(day)
+            elif self._file.tell() >= self.max_segment_bytes:
+                self._open_segment(day)
+            self._file.write(line)
+            self._pending += 1
+            if (self._pending >= self.fsync_every or
+                    time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def flush(self):
+        """Force pending entries to disk"""
+        with self._lock:
+            if self._file and self._pending:
+                self._sync()
+
+    def close(self):
+        with self._lock:
+            self._close_file()
+            self._segment_path = None
+
+    # Lectura
+    def read(self, since=None, until=None):
+        """Yield entries from oldest to newest, archives included, skipping a torn trailing line
+
+        With `since`/`until` (dates or datetimes) only the segments of those days
+        are opened, so reading a range does not depend on the size of the history.
+        """
+        self.flush()
+        first = since.strftime("%Y%m%d") if since else None
+        last = until.strftime("%Y%m%d") if until else None
+        for path in self.segments():
+            day = _segment_key(path)[:8]
+            if (first and day < first) or (last and day > last):
+                continue
+            with _open_text(path) as f:
+                for line in f:
+                    try:
+                        yield expand_entry(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue
+
+    def disk_usage(self):
+        """Bytes used by live segments and by archives"""
+        live = archived = 0
+        for path in self.segments():
+            size = os.path.getsize(path)
+            if path.endswith(SEGMENT_SUFFIX):
+                live += size
+            else:
+                archived += size
+        return {"activos": live, "archivados": archived}
+
+    def read_all(self):
+        return list(self.read())
+
+    def clear(self):
+        """Delete every segment"""
+        with self._lock:
+            self._close_file()
+            for path in self.segments():
+                os.remove(path)
+
+    # Migración
+    def migrate_legacy(self, legacy_path=LEGACY_LOG_FILE):
+        """Move entries from the old single JSON file into segments; returns the number migrated"""
+        if not os.path.exists(legacy_path):
+            return 0
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                logs = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logs = []
+
+        by_day = {}
+        for entry in logs:
+            stamp = str(entry.get("timestamp", ""))[:10].replace("-", "")
+            day = stamp if len(stamp) == 8 and stamp.isdigit() else datetime.now().strftime("%Y%m%d")
+            by_day.setdefault(day, []).append(entry)
+
+        with self._lock:
+            self._close_file()
+            for day, entries in sorted(by_day.items()):
+                # Los segmentos migrados usan la secuencia 000 y preceden a los nuevos
+                path = self._segment_name(day, 0)
+                existing = ""
+                if os.path.exists(path):
+                    with open(path, "r", encoding="utf-8") as f:
+                        existing = f.read()
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(compact_entry(entry), default=str, ensure_ascii=False) + "\n")
+                    f.write(existing)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+        os.replace(legacy_path, legacy_path + ".migrated")
+        return len(logs)
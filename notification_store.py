@@ -0,0 +1,313 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from notification_log import compact_entry, expand_entry
+
+DB_FILE = "notificaciones.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS appointments (
+    rut TEXT NOT NULL,
+    fecha_atencion TEXT NOT NULL,
+    phone TEXT,
+    patient TEXT,
+    source TEXT,
+    notified INTEGER NOT NULL DEFAULT 0,
+    changed INTEGER NOT NULL DEFAULT 0,
+    fecha_notificacion TEXT,
+    metodo TEXT,
+    updated_at TEXT,
+    PRIMARY KEY (rut, fecha_atencion)
+);
+CREATE INDEX IF NOT EXISTS idx_appointments_phone ON appointments(phone);
+CREATE INDEX IF NOT EXISTS idx_appointments_fecha ON appointments(fecha_atencion);
+CREATE INDEX IF NOT EXISTS idx_appointments_source_status ON appointments(source, notified, changed);
+
+-- Una fila por agenda sincronizada (source = digest del contenido). Las filas sin
+-- RUT o fecha, o con la clave repetida, no tienen fila propia en appointments
+-- y se cuentan aquí para que las estadísticas cubran toda la agenda.
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    name TEXT,
+    rows INTEGER NOT NULL,
+    unkeyed INTEGER NOT NULL DEFAULT 0,
+    unkeyed_notified INTEGER NOT NULL DEFAULT 0,
+    unkeyed_changed INTEGER NOT NULL DEFAULT 0,
+    synced_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    rut TEXT,
+    phone TEXT,
+    patient TEXT,
+    fecha_atencion TEXT,
+    type TEXT,
+    method TEXT,
+    status TEXT,
+    result TEXT,
+    message TEXT,
+    template TEXT,
+    params TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_attempts_rut_fecha ON attempts(rut, fecha_atencion);
+CREATE INDEX IF NOT EXISTS idx_attempts_phone ON attempts(phone);
+CREATE INDEX IF NOT EXISTS idx_attempts_status_ts ON attempts(status, timestamp);
+CREATE INDEX IF NOT EXISTS idx_attempts_ts ON attempts(timestamp);
+CREATE INDEX IF NOT EXISTS idx_attempts_patient ON attempts(patient COLLATE NOCASE);
+"""
+
+ATTEMPT_COLUMNS = ['timestamp', 'rut', 'phone', 'patient', 'fecha_atencion',
+                   'type', 'method', 'status', 'result', 'message']
+# Un mensaje de plantilla se guarda como id de plantilla + valores (JSON) y message queda NULL
+STORED_ATTEMPT_COLUMNS = ATTEMPT_COLUMNS + ['template', 'params']
+# Proyección por defecto del visor: sin el cuerpo del mensaje
+ATTEMPT_SUMMARY_COLUMNS = ['id', 'timestamp', 'rut', 'patient', 'phone', 'fecha_atencion',
+                           'type', 'method', 'status', 'result']
+
+
+def _text(value):
+    """Normalize a cell to the TEXT form used as key in the store"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (pd.Timestamp, datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def _attempt_row(entry):
+    """Values for STORED_ATTEMPT_COLUMNS, with a templated message compacted as in the JSON Lines log"""
+    entry = compact_entry(entry)
+    params = entry.get("params")
+    return ([_text(entry.get(col)) for col in ATTEMPT_COLUMNS] +
+            [entry.get("template"), json.dumps(params, ensure_ascii=False) if params is not None else None])
+
+
+def _message_text(message, template, params):
+    if template is None:
+        return message
+    return expand_entry({"template": template, "params": json.loads(params)})["message"]
+
+
+class NotificationStore:
+    """Embedded SQLite store (WAL) for appointments and notification attempts"""
+
+    def __init__(self, db_path=DB_FILE):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Add the template columns to an older attempts table and compact the messages already stored"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(attempts)")}
+        if "template" in columns:
+            return
+        with self.conn:
+            self.conn.execute("ALTER TABLE attempts ADD COLUMN template TEXT")
+            self.conn.execute("ALTER TABLE attempts ADD COLUMN params TEXT")
+            rows = self.conn.execute("SELECT id, message FROM attempts WHERE message IS NOT NULL")
+            updates = []
+            for attempt_id, message in rows:
+                entry = compact_entry({"message": message})
+                if "template" in entry:
+                    updates.append((entry["template"], json.dumps(entry["params"], ensure_ascii=False), attempt_id))
+            self.conn.executemany("UPDATE attempts SET message = NULL, template = ?, params = ? WHERE id = ?",
+                                  updates)
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    # Citas
+    def sync_appointments(self, df, source, name=None):
+        """Upsert the uploaded agenda; a notification already recorded is never lost
+
+        `source` identifies this exact agenda (the content digest of the upload),
+        so re-uploading an edited file under the same name starts a new scope.
+        """
+        now = datetime.now().isoformat()
+        # Las banderas pueden venir como booleanos anulables: <NA> cuenta como no marcada
+        notified_flags = df['¿NOTIFICADO?'].eq(True).fillna(False).astype(int)
+        changed_flags = df['¿CAMBIO DE HORA?'].eq(True).fillna(False).astype(int)
+        rows, seen = [], set()
+        unkeyed = unkeyed_notified = unkeyed_changed = 0
+        for rut, fecha, phone, patient, notified, changed in zip(
+                df['RUT'], df['FECHA_ATENCION'], df['TELEFONO'], df['NOMBRE_PACIENTE'],
+                notified_flags, changed_flags):
+            key = (_text(rut), _text(fecha))
+            if key[0] is None or key[1] is None or key in seen:
+                unkeyed += 1
+                unkeyed_notified += int(notified)
+                unkeyed_changed += int(changed)
+                continue
+            seen.add(key)
+            rows.append((*key, _text(phone), _text(patient), source, int(notified), int(changed), now))
+        with self._lock, self.conn:
+            self.conn.execute("""
+                INSERT OR REPLACE INTO sources (source, name, rows, unkeyed, unkeyed_notified,
+                                                unkeyed_changed, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (source, name, len(df), unkeyed, unkeyed_notified, unkeyed_changed, now))
+            self.conn.executemany("""
+                INSERT INTO appointments (rut, fecha_atencion, phone, patient, source,
+                                          notified, changed, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(rut, fecha_atencion) DO UPDATE SET
+                    phone = excluded.phone,
+                    patient = excluded.patient,
+                    source = excluded.source,
+                    notified = MAX(appointments.notified, excluded.notified),
+                    changed = excluded.changed,
+                    updated_at = excluded.updated_at
+            """, rows)
+        return len(rows)
+
+    def mark_notified(self, rut, fecha_atencion, tipo, method, timestamp=None):
+        timestamp = timestamp or datetime.now().isoformat()
+        flag = "changed = 0" if tipo == "Cambio de Cita" else "notified = 1"
+        with self._lock, self.conn:
+            self.conn.execute(f"""
+                UPDATE appointments
+                SET {flag}, fecha_notificacion = ?, metodo = ?, updated_at = ?
+                WHERE rut = ? AND fecha_atencion = ?
+            """, (timestamp, method, timestamp, _text(rut), _text(fecha_atencion)))
+
+    def appointment_stats(self, source):
+        """Counts for the metric cards, answered from idx_appointments_source_status
+
+        Rows of the agenda without an appointments row of their own count with
+        the flags they had in the file.
+        """
+        with self._lock:
+            row = self.conn.execute("""
+                SELECT COUNT(*) AS total,
+                       COALESCE(SUM(notified), 0) AS notificados,
+                       COALESCE(SUM(changed), 0) AS cambios
+                FROM appointments WHERE source = ?
+            """, (source,)).fetchone()
+            extra = self.conn.execute("""
+                SELECT unkeyed, unkeyed_notified, unkeyed_changed FROM sources WHERE source = ?
+            """, (source,)).fetchone()
+        total = row['total'] + (extra['unkeyed'] if extra else 0)
+        notificados = row['notificados'] + (extra['unkeyed_notified'] if extra else 0)
+        return {
+            'total': total,
+            'notificados': notificados,
+            'pendientes': total - notificados,
+            'cambios': row['cambios'] + (extra['unkeyed_changed'] if extra else 0),
+        }
+
+    # Intentos
+    def record_attempt(self, entry):
+        values = _attempt_row(entry)
+        with self._lock, self.conn:
+            self.conn.execute(f"""
+                INSERT INTO attempts ({', '.join(STORED_ATTEMPT_COLUMNS)})
+                VALUES ({', '.join('?' * len(STORED_ATTEMPT_COLUMNS))})
+            """, values)
+
+    def import_attempts(self, entries):
+        """Bulk load attempts, e.g. from the JSON Lines log"""
+        rows = [_attempt_row(entry) for entry in entries]
+        with self._lock, self.conn:
+            self.conn.executemany(f"""
+                INSERT INTO attempts ({', '.join(STORED_ATTEMPT_COLUMNS)})
+                VALUES ({', '.join('?' * len(STORED_ATTEMPT_COLUMNS))})
+            """, rows)
+        return len(rows)
+
+    def attempt_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM attempts").fetchone()[0]
+
+    def was_notified(self, rut, fecha_atencion, tipo=None):
+        """Was this RUT already notified for this appointment date?"""
+        query = """SELECT 1 FROM attempts
+                   WHERE rut = ? AND fecha_atencion = ? AND status = 'Enviado'"""
+        params = [_text(rut), _text(fecha_atencion)]
+        if tipo:
+            query += " AND type = ?"
+            params.append(tipo)
+        with self._lock:
+            return self.conn.execute(query + " LIMIT 1", params).fetchone() is not None
+
+    def errors_since(self, since):
+        """Failed attempts from `since` onwards (e.g. all errors today)"""
+        return self.query_attempts(status="Error", since=since)
+
+    @staticmethod
+    def _attempt_filters(status=None, since=None, until=None, method=None, tipo=None, patient=None):
+        """WHERE clause and parameters shared by query_attempts and count_attempts"""
+        clauses, params = [], []
+        for column, value in (("status", status), ("method", method), ("type", tipo)):
+            if value:
+                # '+' evita el índice: con pocas categorías conviene recorrer la PK hacia atrás y cortar en LIMIT
+                clauses.append(f"+{column} = ?")
+                params.append(value)
+        if since:
+            clauses.append("timestamp >= ?")
+            params.append(_text(since))
+        if until:
+            clauses.append("timestamp < ?")
+            params.append(_text(until))
+        if patient:
+            # RUT exacto o nombre por prefijo (usa idx_attempts_patient, sin distinguir mayúsculas)
+            clauses.append("(rut = ? OR patient LIKE ? COLLATE NOCASE)")
+            params.extend([patient, patient.replace("%", "").replace("_", "") + "%"])
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        return where, params
+
+    def query_attempts(self, status=None, since=None, until=None, method=None, tipo=None, patient=None,
+                       columns=None, limit=1000, before_id=None):
+        """One page of attempts, newest first
+
+        Pages are keyset-paginated: pass the smallest id of the previous page as
+        `before_id`. Message bodies are left out unless listed in `columns`, and
+        are then rebuilt from their template for the rows of the page only.
+        """
+        columns = [c for c in (columns or ATTEMPT_SUMMARY_COLUMNS) if c in ['id'] + ATTEMPT_COLUMNS]
+        selected = columns + ['template', 'params'] if 'message' in columns else columns
+        where, params = self._attempt_filters(status, since, until, method, tipo, patient)
+        if before_id is not None:
+            where += (" AND " if where else " WHERE ") + "id < ?"
+            params.append(before_id)
+        query = f"SELECT {', '.join(selected)} FROM attempts{where} ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        page = pd.DataFrame([tuple(r) for r in rows], columns=selected)
+        if 'message' in columns:
+            page['message'] = [_message_text(*values) for values in
+                               zip(page['message'], page.pop('template'), page.pop('params'))]
+        return page
+
+    def count_attempts(self, status=None, since=None, until=None, method=None, tipo=None, patient=None):
+        where, params = self._attempt_filters(status, since, until, method, tipo, patient)
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM attempts{where}", params).fetchone()[0]
+
+    def attempt_message(self, attempt_id):
+        """Message body of one attempt, loaded only when the viewer asks for it"""
+        with self._lock:
+            row = self.conn.execute("SELECT message, template, params FROM attempts WHERE id = ?",
+                                    (attempt_id,)).fetchone()
+        return _message_text(*row) if row else None
+
+    def clear_attempts(self):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM attempts")
+
+    def prune_attempts(self, before):
+        """Delete attempts logged before the datetime `before` (uses idx_attempts_ts); returns how many"""
+        with self._lock, self.conn:
+            return self.conn.execute("DELETE FROM attempts WHERE timestamp < ?", (before.isoformat(),)).rowcount
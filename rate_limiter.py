@@ -0,0 +1,103 @@
+import threading
+import time
+
+# (mensajes por segundo, ráfaga) por método de envío
+DEFAULT_LIMITS = {
+    "selenium": (0.5, 1),
+    "webhook": (20.0, 20),
+    "api_link": (100.0, 100),
+}
+
+
+# Respuestas HTTP con las que el canal pide bajar el ritmo
+BACKPRESSURE_STATUS = frozenset({429, 503})
+# Excepciones de tiempo agotado, por nombre de clase para no importar requests ni selenium aquí
+TIMEOUT_ERRORS = frozenset({"TimeoutError", "Timeout", "TimeoutException"})
+
+
+def is_timeout(error):
+    """True for socket, requests and Selenium timeout exceptions (and their subclasses)"""
+    return any(cls.__name__ in TIMEOUT_ERRORS for cls in type(error).__mro__)
+
+
+def is_read_timeout(error):
+    """True when the request went out but no answer arrived in time (requests/urllib3 read timeouts)"""
+    return any(cls.__name__ in ("ReadTimeout", "ReadTimeoutError") for cls in type(error).__mro__)
+
+
+class SendResult(str):
+    """Result text of a send that also carries the HTTP status and whether the channel pushed back
+
+    Still a str, so logs, tables and the store handle it like any result text.
+    `unconfirmed` marks a send that may have gone out but was never acknowledged.
+    """
+
+    def __new__(cls, text, status=None, backpressure=False, unconfirmed=False):
+        result = super().__new__(cls, text)
+        result.status = status
+        result.backpressure = bool(backpressure or status in BACKPRESSURE_STATUS)
+        result.unconfirmed = unconfirmed
+        return result
+
+
+def is_backpressure(result):
+    """True when a send result says the channel wants us to slow down"""
+    return getattr(result, "backpressure", False)
+
+
+class TokenBucket:
+    """Thread-safe token bucket that halves its rate on back-pressure and recovers slowly"""
+
+    def __init__(self, rate, burst, min_rate=None):
+        self._lock = threading.Lock()
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.min_rate = min_rate or self.max_rate / 16
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    def configure(self, rate, burst):
+        """Apply new sidebar settings without losing the current adaptation state"""
+        with self._lock:
+            rate = float(rate)
+            if rate != self.max_rate:
+                self.max_rate = rate
+                self.rate = rate
+                self.min_rate = rate / 16
+            self.burst = max(1, int(burst))
+            self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, n=1):
+        """Reserve `n` tokens, sleeping until they are available; returns the time waited
+
+        Reservations may push the bucket into debt, so a batch larger than the
+        burst size still goes through at the configured average rate.
+        """
+        with self._lock:
+            self._refill()
+            self.tokens -= n
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def penalize(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def record(self, success, result):
+        """Adapt the rate from a send outcome"""
+        if is_backpressure(result):
+            self.penalize()
+        elif success:
+            self.reward()
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+FLUSH_EVERY = 2000
+
+
+def assign_column(df, rows, column, values):
+    """df.loc assignment that keeps categorical columns categorical"""
+    current = df[column]
+    if isinstance(current.dtype, pd.CategoricalDtype):
+        new = pd.Index(np.atleast_1d(values)).dropna().unique().difference(current.cat.categories)
+        if len(new):
+            df[column] = current.cat.add_categories(new)
+    df.loc[rows, column] = values
+
+
+class ResultBuffer:
+    """Send outcomes collected column-wise and written back to the agenda in vectorized batches"""
+
+    def __init__(self, df, flush_every=FLUSH_EVERY):
+        self.df = df
+        self.flush_every = flush_every
+        self.applied = 0
+        self._reset()
+
+    def _reset(self):
+        self._index = []
+        self._tipo = []
+        self._success = []
+        self._timestamp = []
+        self._method = []
+        self._message_id = []
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, idx, tipo, success, timestamp, method, message_id=None):
+        self._index.append(idx)
+        self._tipo.append(tipo)
+        self._success.append(bool(success))
+        self._timestamp.append(timestamp)
+        self._method.append(method)
+        self._message_id.append(message_id)
+        if len(self._index) >= self.flush_every:
+            self.flush()
+
+    def frame(self):
+        """Pending outcomes as a typed frame (index, tipo, success, timestamp, method, message_id)"""
+        return pd.DataFrame({
+            'index': self._index,
+            'tipo': pd.Categorical(self._tipo, categories=["Recordatorio", "Cambio de Cita"]),
+            'success': np.array(self._success, dtype=bool),
+            'timestamp': pd.to_datetime(pd.Series(self._timestamp, dtype=object)),
+            'method': pd.Categorical(self._method),
+            'message_id': self._message_id,
+        })
+
+    def flush(self):
+        """Apply pending successes to the agenda with one assignment per column; returns the rows written"""
+        if not self._index:
+            return 0
+        results = self.frame()
+        self._reset()
+        sent = results[results['success']]
+        if sent.empty:
+            return 0
+        df = self.df
+        is_reminder = (sent['tipo'] == "Recordatorio").to_numpy()
+        assign_column(df, sent['index'].to_numpy()[is_reminder], '¿NOTIFICADO?', True)
+        assign_column(df, sent['index'].to_numpy()[~is_reminder], '¿CAMBIO DE HORA?', False)
+        rows = sent['index'].to_numpy()
+        assign_column(df, rows, 'FECHA_NOTIFICACION', sent['timestamp'].dt.normalize().to_numpy())
+        stamps = sent['timestamp'].dt
+        # Más rápido que .dt.strftime, que formatea elemento a elemento
+        hours = [f"{h:02d}:{m:02d}:{s:02d}" for h, m, s in zip(stamps.hour, stamps.minute, stamps.second)]
+        assign_column(df, rows, 'HORA_NOTIFICACION', np.array(hours, dtype=object))
+        assign_column(df, rows, 'METODO_NOTIFICACION', sent['method'].to_numpy(dtype=object))
+        self.applied += len(sent)
+        return len(sent)
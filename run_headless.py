@@ -0,0 +1,156 @@
+"""Run a notification campaign without the Streamlit UI (cron, systemd timers, CI)
+
+    python run_headless.py agenda.xlsx --method webhook --webhook-url https://... --output actualizada.xlsx
+
+Exit codes: 0 all sends succeeded, 1 some sends failed or were left unconfirmed, 2 the agenda could not be read
+or the requested method cannot send from here.
+
+API links are refused: they only build a wa.me URL for someone to open, and
+no one is there to open it in a scheduled run.
+"""
+import argparse
+import sys
+import time
+from contextlib import closing
+from datetime import datetime
+
+from agenda import NOTIFICATION_WINDOW_DAYS, select_invalid_phones, window_bounds
+from checkpoint import CampaignCheckpoint
+from dispatcher import build_session
+from export import export_agenda, format_for_path
+from idempotency import DEFAULT_TTL, IdempotencyIndex
+from metrics import METRICS
+from notification_log import NotificationLog
+from notification_store import NotificationStore
+from notificaciones import (PROFILES_DIR, SeleniumPool, build_dispatcher, claim_jobs, collect_jobs,
+                            iter_results, load_data, resolve_method, save_log)
+from rate_limiter import DEFAULT_LIMITS, TokenBucket
+from upload_cache import UploadCache, content_digest
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Envía los recordatorios y cambios de cita de una agenda")
+    parser.add_argument("agenda", help="archivo .xlsx, .xls o .csv con las citas")
+    parser.add_argument("--method", default="auto", choices=["auto", "selenium", "webhook"])
+    parser.add_argument("--webhook-url", help="URL del webhook (requerida con --method webhook)")
+    parser.add_argument("--window", type=int, default=NOTIFICATION_WINDOW_DAYS,
+                        help="días hacia adelante que cubre la campaña")
+    parser.add_argument("--concurrency", type=int, default=8, help="envíos simultáneos por webhook")
+    parser.add_argument("--batch-size", type=int, default=0, help="mensajes por POST en modo lote (0 = sin lote)")
+    parser.add_argument("--linger", type=float, default=0.5, help="espera máxima por lote, en segundos")
+    parser.add_argument("--rate", type=float, help="mensajes por segundo (por defecto según el método)")
+    parser.add_argument("--burst", type=int, help="ráfaga máxima (por defecto según el método)")
+    parser.add_argument("--senders", default="principal", help="remitentes de Selenium separados por coma")
+    parser.add_argument("--output", help="agenda actualizada de salida (.xlsx, .csv o .parquet)")
+    parser.add_argument("--no-cache", action="store_true", help="no usar la caché de agendas en disco")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignorar el avance registrado de una ejecución anterior de esta agenda")
+    parser.add_argument("--dedup-days", type=float, default=DEFAULT_TTL / 86400,
+                        help="días durante los que un mensaje ya enviado no se repite")
+    parser.add_argument("--log-retention-days", type=int,
+                        help="borrar el log y los intentos guardados más antiguos que esto (por defecto se conservan)")
+    parser.add_argument("--metrics-file",
+                        help="medir tiempos por etapa y escribirlos en este archivo (formato de texto de Prometheus)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.method == "webhook" and not args.webhook_url:
+        print("--webhook-url es obligatorio con --method webhook", file=sys.stderr)
+        return 2
+    # Sin DISPLAY (cron) ENV_INFO no ofrece Selenium y resolve_method caería en links sin avisar
+    method = resolve_method(args.method)
+    if method != "selenium" and method != "webhook":
+        wanted = "Selenium" if args.method == "selenium" else "ningún método de envío automático"
+        print(f"No hay {wanted} disponible en este entorno (sin DISPLAY o sin el paquete selenium); "
+              "use --method webhook o ejecute con una sesión gráfica", file=sys.stderr)
+        return 2
+    if args.metrics_file:
+        METRICS.enabled = True
+
+    cache = None if args.no_cache else UploadCache()
+    if cache is not None and not cache.enabled:
+        print("Caché de agendas deshabilitada: falta pyarrow", file=sys.stderr)
+    try:
+        digest = content_digest(args.agenda)
+        df, date_index = load_data(args.agenda, cache, digest)
+    except Exception as e:
+        print(f"Error al cargar el archivo: {e}", file=sys.stderr)
+        return 2
+
+    store = NotificationStore()
+    # La retención vale para los segmentos del log y para la tabla de intentos
+    log = NotificationLog(retention_days=args.log_retention_days, on_expire=store.prune_attempts)
+    log.migrate_legacy()
+    store.sync_appointments(df, digest, args.agenda)
+
+    # Diario de avance por contenido de la agenda: una ejecución cortada se reanuda sin duplicados
+    checkpoint = CampaignCheckpoint(digest)
+    if args.fresh:
+        checkpoint.clear()
+    restored = checkpoint.apply(df)
+    if restored:
+        print(f"Reanudando: {restored} envíos ya registrados se omiten")
+
+    rate, burst = DEFAULT_LIMITS[method]
+    limiter = TokenBucket(args.rate or rate, args.burst or burst)
+    pool = None
+    if method == "selenium":
+        senders = [s.strip() for s in args.senders.split(",") if s.strip()] or ['principal']
+        pool = SeleniumPool(senders, PROFILES_DIR)
+    session = build_session(args.concurrency) if method == "webhook" else None
+
+    jobs = collect_jobs(df, date_index, window_days=args.window, checkpoint=checkpoint)
+    idempotency = IdempotencyIndex(ttl=args.dedup_days * 86400)
+    jobs, duplicates = claim_jobs(jobs, idempotency)
+    if duplicates:
+        print(f"{duplicates} notificaciones repetidas o ya enviadas anteriormente se omiten")
+    print(f"{len(df)} citas, {len(jobs)} notificaciones en la ventana de {args.window} días (método: {method})")
+    rejected = select_invalid_phones(df, date_index, *window_bounds(datetime.now().date(), args.window))
+    for _, row in rejected.iterrows():
+        print(f"Rechazado {row['NOMBRE_PACIENTE']}: teléfono inválido ({row['TELEFONO']})", file=sys.stderr)
+
+    success_count = 0
+    error_count = 0
+    unconfirmed_count = 0
+    started = time.perf_counter()
+    try:
+        dispatcher = build_dispatcher(method, limiter=limiter, pool=pool, webhook_url=args.webhook_url,
+                                      session=session, concurrency=args.concurrency,
+                                      batch_size=args.batch_size, max_linger=args.linger)
+        # closing(): ante una interrupción, lo enviado se registra antes de cerrar el checkpoint
+        with closing(iter_results(df, jobs, dispatcher, method, checkpoint, idempotency,
+                                  log_fn=lambda entry: save_log(entry, log, store))) as results:
+            for idx, tipo, row, message, success, result, log_entry in results:
+                save_log(log_entry, log, store)
+                if success:
+                    success_count += 1
+                elif log_entry['status'] == "Sin confirmar":
+                    unconfirmed_count += 1
+                    print(f"Sin confirmar {tipo} {row['NOMBRE_PACIENTE']} ({row['TELEFONO_E164']}): {result}",
+                          file=sys.stderr)
+                else:
+                    error_count += 1
+                    print(f"Error {tipo} {row['NOMBRE_PACIENTE']} ({row['TELEFONO_E164']}): {result}", file=sys.stderr)
+    finally:
+        checkpoint.close()
+        idempotency.close()
+        log.close()
+        if pool is not None:
+            pool.close_all()
+    elapsed = time.perf_counter() - started
+
+    if args.output:
+        with METRICS.timed("export"):
+            export_agenda(df, format_for_path(args.output), args.output)
+    if args.metrics_file:
+        METRICS.write_textfile(args.metrics_file)
+
+    print(f"Exitosos: {success_count}  Errores: {error_count}  Sin confirmar: {unconfirmed_count}  "
+          f"Tiempo: {elapsed:.1f} s  ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})")
+    return 1 if error_count or unconfirmed_count else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,34 @@
+import pandas as pd
+
+from agenda import iter_agenda_chunks, parse_dates
+
+HEADER = "RUT;NOMBRE_PACIENTE;TELEFONO;FECHA_ATENCION;PROFESIONAL;MOTIVO_CONSULTA\n"
+
+
+def read_csv_agenda(path):
+    return pd.concat(list(iter_agenda_chunks(str(path))), ignore_index=True)
+
+
+def test_csv_dates_are_read_day_first(tmp_path):
+    path = tmp_path / "agenda.csv"
+    path.write_text(HEADER
+                    + "11111111-1;Ana;912345678;05/10/2026 09:00;Dra. Soto;Control\n"
+                    + "22222222-2;Luis;912345679;20/10/2026;Dr. Rojas;Control\n", encoding="utf-8")
+    df = read_csv_agenda(path)
+    assert list(df['FECHA_ATENCION']) == [pd.Timestamp("2026-10-05 09:00"), pd.Timestamp("2026-10-20")]
+
+
+def test_parse_dates_keeps_iso_text_and_excel_dates():
+    column = pd.Series(["2026-10-20 10:30:00", pd.Timestamp("2026-11-03"), "03/11/2026", None, "sin fecha"])
+    assert list(parse_dates(column)) == [pd.Timestamp("2026-10-20 10:30"), pd.Timestamp("2026-11-03"),
+                                         pd.Timestamp("2026-11-03"), pd.NaT, pd.NaT]
+
+
+def test_csv_saved_by_excel_as_cp1252_is_read(tmp_path):
+    path = tmp_path / "agenda.csv"
+    path.write_bytes((HEADER + "11111111-1;Begoña Muñoz;912345678;21/10/2026 11:15;Dr. Peña;Evaluación\n")
+                     .encode("cp1252"))
+    df = read_csv_agenda(path)
+    assert df.loc[0, 'NOMBRE_PACIENTE'] == "Begoña Muñoz"
+    assert df.loc[0, 'MOTIVO_CONSULTA'] == "Evaluación"
+    assert df.loc[0, 'FECHA_ATENCION'] == pd.Timestamp("2026-10-21 11:15")
@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import Counter
+
+import pandas as pd
+import pytest
+import requests
+
+from checkpoint import CampaignCheckpoint
+from dispatcher import BatchDispatcher, Dispatcher
+from idempotency import IdempotencyIndex
+from notificaciones import WhatsAppAPI, claim_jobs, iter_results, job_key, save_log
+from notification_log import NotificationLog
+from notification_store import NotificationStore
+from rate_limiter import SendResult
+
+
+def make_campaign(n=40):
+    """Agenda with the columns iter_results writes back, and one reminder job per row"""
+    df = pd.DataFrame({
+        'RUT': [f"{10_000_000 + i}-{i % 10}" for i in range(n)],
+        'NOMBRE_PACIENTE': [f"Paciente {i}" for i in range(n)],
+        'TELEFONO_E164': [f"+5691234{i:04d}" for i in range(n)],
+        'FECHA_ATENCION': pd.date_range("2026-10-20 08:00", periods=n, freq="15min"),
+        '¿NOTIFICADO?': False,
+        '¿CAMBIO DE HORA?': False,
+        'FECHA_NOTIFICACION': pd.NaT,
+        'HORA_NOTIFICACION': None,
+        'METODO_NOTIFICACION': None,
+    })
+    jobs = {(idx, "Recordatorio"): (row, f"Hola {row['NOMBRE_PACIENTE']}") for idx, row in df.iterrows()}
+    return df, jobs
+
+
+class RecordingGateway:
+    """Counts the messages each phone receives, with a small per-request latency"""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.sent = Counter()
+        self._lock = threading.Lock()
+
+    def send(self, phone, message):
+        time.sleep(self.delay)
+        with self._lock:
+            self.sent[phone] += 1
+        return True, "Mensaje enviado via webhook"
+
+    def send_batch(self, items):
+        time.sleep(self.delay)
+        with self._lock:
+            self.sent.update(phone for phone, _ in items)
+        return [(True, "Mensaje enviado via webhook (lote)")] * len(items)
+
+
+DISPATCHERS = {
+    "concurrente": lambda gateway: Dispatcher(gateway.send, max_workers=4),
+    "lotes": lambda gateway: BatchDispatcher(gateway.send_batch, batch_size=3, max_linger=0.01, max_workers=2),
+}
+
+
+def pending(jobs, checkpoint):
+    return {job: (row, message) for job, (row, message) in jobs.items()
+            if not checkpoint.is_done(row['RUT'], row['FECHA_ATENCION'], job[1])}
+
+
+@pytest.mark.parametrize("kind", sorted(DISPATCHERS))
+def test_interrupted_campaign_resumes_sending_each_job_once(tmp_path, kind):
+    df, jobs = make_campaign()
+    gateway = RecordingGateway()
+
+    checkpoint = CampaignCheckpoint("campana", tmp_path)
+    results = iter_results(df, jobs, DISPATCHERS[kind](gateway), "webhook", checkpoint)
+    consumed = [next(results) for _ in range(5)]
+    results.close()
+    checkpoint.close()
+    # Los envíos que estaban en vuelo al cortar también quedan registrados
+    assert sum(gateway.sent.values()) > len(consumed)
+
+    checkpoint = CampaignCheckpoint("campana", tmp_path)
+    assert len(checkpoint) == sum(gateway.sent.values())
+    remaining = pending(jobs, checkpoint)
+    assert len(remaining) == len(jobs) - len(checkpoint)
+    for _ in iter_results(df, remaining, DISPATCHERS[kind](gateway), "webhook", checkpoint):
+        pass
+    checkpoint.close()
+
+    assert set(gateway.sent) == {row['TELEFONO_E164'] for row, _ in jobs.values()}
+    assert set(gateway.sent.values()) == {1}
+    assert df['¿NOTIFICADO?'].all()
+
+
+def interrupt_claimed_run(tmp_path, kind, consume=5):
+    """Claim every job, stop consuming after `consume` results; returns (jobs, gateway, index)"""
+    df, jobs = make_campaign()
+    gateway = RecordingGateway()
+    index = IdempotencyIndex(str(tmp_path / "notificaciones.db"))
+    claimed, duplicates = claim_jobs(jobs, index)
+    assert (len(claimed), duplicates) == (len(jobs), 0)
+    results = iter_results(df, claimed, DISPATCHERS[kind](gateway), "webhook", idempotency=index)
+    for _ in range(consume):
+        next(results)
+    results.close()
+    return jobs, gateway, index
+
+
+@pytest.mark.parametrize("kind", sorted(DISPATCHERS))
+def test_interrupted_run_logs_and_stores_sends_that_were_in_flight(tmp_path, kind):
+    df, jobs = make_campaign()
+    df['TELEFONO'] = df['TELEFONO_E164']
+    gateway = RecordingGateway()
+    log = NotificationLog(str(tmp_path / "logs"))
+    store = NotificationStore(str(tmp_path / "notificaciones.db"))
+    store.sync_appointments(df, "campana")
+
+    def record(entry):
+        save_log(entry, log, store)
+
+    results = iter_results(df, jobs, DISPATCHERS[kind](gateway), "webhook", log_fn=record)
+    for _ in range(5):
+        record(next(results)[-1])
+    results.close()
+
+    sent = sum(gateway.sent.values())
+    assert sent > 5
+    entries = log.read_all()
+    assert sorted(e['phone'] for e in entries) == sorted(gateway.sent.elements())
+    assert {e['status'] for e in entries} == {"Enviado"}
+    assert store.count_attempts() == sent
+    assert store.appointment_stats("campana")['notificados'] == sent
+    log.close()
+    store.close()
+
+
+def confirmed_keys(index):
+    return {row[0]: row[1] for row in index.conn.execute("SELECT key, confirmed FROM idempotency")}
+
+
+@pytest.mark.parametrize("kind", sorted(DISPATCHERS))
+def test_interrupted_run_releases_claims_of_jobs_never_sent(tmp_path, kind):
+    jobs, gateway, index = interrupt_claimed_run(tmp_path, kind)
+    unsent = [job for job, (row, _) in jobs.items() if row['TELEFONO_E164'] not in gateway.sent]
+    assert unsent
+    stored = confirmed_keys(index)
+    assert not any(job_key(jobs[job][0], job[1], jobs[job][1]) in stored for job in unsent)
+
+    # Se pueden volver a reclamar de inmediato, sin esperar el vencimiento del lease
+    fresh, duplicates = claim_jobs(jobs, index)
+    assert sorted(fresh) == sorted(unsent)
+    assert duplicates == len(jobs) - len(unsent)
+    index.close()
+
+
+@pytest.mark.parametrize("kind", sorted(DISPATCHERS))
+def test_interrupted_run_confirms_jobs_sent_but_not_consumed(tmp_path, kind):
+    jobs, gateway, index = interrupt_claimed_run(tmp_path, kind)
+    sent = {job_key(row, job[1], message) for job, (row, message) in jobs.items()
+            if row['TELEFONO_E164'] in gateway.sent}
+    assert len(sent) > 5
+    assert confirmed_keys(index) == dict.fromkeys(sent, 1)
+    index.close()
+
+
+def test_unconfirmed_send_keeps_its_claim_and_is_not_journaled(tmp_path):
+    df, jobs = make_campaign(4)
+    index = IdempotencyIndex(str(tmp_path / "notificaciones.db"))
+    checkpoint = CampaignCheckpoint("campana", tmp_path)
+    claimed, _ = claim_jobs(jobs, index)
+
+    def send(phone, message):
+        if phone.endswith("0000"):
+            return False, SendResult("Sin confirmación de envío tras 15 s", unconfirmed=True)
+        if phone.endswith("0001"):
+            return False, "Error webhook: 500"
+        return True, "Mensaje enviado via webhook"
+
+    statuses = {row['TELEFONO_E164']: entry['status'] for _, _, row, _, _, _, entry in
+                iter_results(df, claimed, Dispatcher(send), "webhook", checkpoint, index)}
+    assert statuses == {"+56912340000": "Sin confirmar", "+56912340001": "Error",
+                        "+56912340002": "Enviado", "+56912340003": "Enviado"}
+    assert len(checkpoint) == 2
+    assert not df.loc[0, '¿NOTIFICADO?']
+    # El fallido se puede reintentar; el sin confirmar sigue reclamado y no se reenvía
+    fresh, duplicates = claim_jobs(jobs, index)
+    assert [claimed[job][0]['TELEFONO_E164'] for job in fresh] == ["+56912340001"]
+    assert duplicates == 3
+    checkpoint.close()
+    index.close()
+
+
+def test_identical_rows_in_one_upload_are_sent_once(tmp_path):
+    df, _ = make_campaign(3)
+    df = pd.concat([df, df.iloc[[1]]], ignore_index=True)
+    jobs = {(idx, "Recordatorio"): (row, f"Hola {row['NOMBRE_PACIENTE']}") for idx, row in df.iterrows()}
+    index = IdempotencyIndex(str(tmp_path / "notificaciones.db"))
+    claimed, duplicates = claim_jobs(jobs, index)
+    assert sorted(claimed) == [(0, "Recordatorio"), (1, "Recordatorio"), (2, "Recordatorio")]
+    assert duplicates == 1
+
+    gateway = RecordingGateway(delay=0)
+    for _ in iter_results(df, claimed, Dispatcher(gateway.send), "webhook", idempotency=index):
+        pass
+    assert set(gateway.sent.values()) == {1}
+    index.close()
+
+
+class FailingSession:
+    def __init__(self, error):
+        self.error = error
+
+    def post(self, url, json=None, timeout=None):
+        raise self.error
+
+
+@pytest.mark.parametrize("error, unconfirmed", [(requests.ReadTimeout("read timed out"), True),
+                                                (requests.ConnectTimeout("connect timed out"), False),
+                                                (requests.ConnectionError("refused"), False)])
+def test_webhook_read_timeout_leaves_the_send_unconfirmed(error, unconfirmed):
+    session = FailingSession(error)
+    success, result = WhatsAppAPI.send_via_webhook("+56912340000", "Hola", "http://gateway", session)
+    assert not success and result.unconfirmed is unconfirmed
+    outcomes = WhatsAppAPI.send_batch_via_webhook([("+56912340000", "Hola")] * 2, "http://gateway", session)
+    assert [result.unconfirmed for _, result in outcomes] == [unconfirmed] * 2
@@ -0,0 +1,22 @@
+from datetime import datetime
+
+from notification_log import NotificationLog
+from notification_store import NotificationStore
+
+
+def attempt(timestamp):
+    return {"timestamp": timestamp.isoformat(), "patient": "Ana", "rut": "11111111-1", "phone": "+56912345678",
+            "fecha_atencion": "2026-10-20 09:00:00", "type": "Recordatorio", "method": "webhook",
+            "message": "Hola", "status": "Enviado", "result": "ok"}
+
+
+def test_retention_prunes_the_attempts_table_too(tmp_path):
+    store = NotificationStore(str(tmp_path / "notificaciones.db"))
+    store.import_attempts([attempt(datetime(2026, 9, 1, 10)), attempt(datetime(2026, 10, 10, 23, 59)),
+                           attempt(datetime(2026, 10, 11, 0, 0)), attempt(datetime(2026, 10, 18, 8))])
+    log = NotificationLog(str(tmp_path / "logs"), retention_days=7, on_expire=store.prune_attempts)
+    log.rotate(today=datetime(2026, 10, 18, 12))
+    assert sorted(store.query_attempts(columns=["timestamp"])["timestamp"]) == [
+        "2026-10-11T00:00:00", "2026-10-18T08:00:00"]
+    log.close()
+    store.close()
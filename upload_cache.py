@@ -0,0 +1,107 @@
+import hashlib
+import os
+import uuid
+
+CACHE_DIR = "upload_cache"
+MAX_CACHE_BYTES = 500 * 1024 * 1024
+
+# Arrow es opcional: sin pyarrow la caché en disco queda deshabilitada
+try:
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+
+def _arrow_strings(arrow_type):
+    # Los textos vuelven como string[pyarrow], sin materializar objetos Python
+    if arrow_type in (pa.string(), pa.large_string()):
+        return pd.StringDtype("pyarrow")
+    return None
+
+
+def content_digest(file, block_size=1024 * 1024):
+    """blake2b hex digest of a file-like object's content (or of a path)"""
+    digest = hashlib.blake2b(digest_size=20)
+    if not hasattr(file, 'read'):
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+    start = file.tell()
+    file.seek(0)
+    for block in iter(lambda: file.read(block_size), b''):
+        digest.update(block)
+    file.seek(start)
+    return digest.hexdigest()
+
+
+class UploadCache:
+    """Normalized agenda frames stored as uncompressed Arrow IPC files, evicted LRU by total size"""
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = ARROW_AVAILABLE
+        if self.enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.cache_dir, f"{digest}.arrow")
+
+    def get(self, digest):
+        """Cached frame, or None on a miss
+
+        The file is read once, without parsing; text columns stay in the Arrow
+        buffers it was read into, other columns are copied by to_pandas.
+        """
+        if not self.enabled:
+            return None
+        path = self._path(digest)
+        try:
+            table = feather.read_table(path)
+        except (OSError, pa.ArrowInvalid):
+            return None
+        os.utime(path)  # marca de uso para el LRU
+        return table.to_pandas(types_mapper=_arrow_strings)
+
+    def put(self, digest, df):
+        """Store `df`; returns False when the frame cannot be represented in Arrow"""
+        if not self.enabled:
+            return False
+        path = self._path(digest)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            feather.write_feather(table, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, path)
+        except (pa.ArrowException, OSError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def entries(self):
+        """(path, size, last_used) for every cached frame, least recently used first"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.arrow'):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size